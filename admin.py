@@ -1,5 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
-from models import db, User, Site, Labour, Employee, LabourEntry
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app, send_file, abort
+from models import db, User, LabourEntry, PayrollRun
+import io
+import os
+import re
+import auth
+import counters
+import importers
+import payroll
+import throttle
 
 # Create blueprint
 admin_bp = Blueprint('admin', __name__)
@@ -11,14 +19,10 @@ def admin_dashboard():
         flash('Access denied.', 'danger')
         return redirect(url_for('login'))
         
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     
-    # Calculate dynamic statistics
-    stats = {
-        'total_labour': Labour.query.count(),  # Total labour records
-        'total_employees': Employee.query.count(),  # Total employee records
-        'active_sites': Site.query.count()  # Total sites (no is_active filter needed)
-    }
+    # Totals and today's attendance from the dashboard counters (one query)
+    stats = counters.get_dashboard_counts()
     
     return render_template('admin.html', user=user, stats=stats)
 
@@ -28,7 +32,7 @@ def admin_m():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('admin_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -89,13 +93,12 @@ def edit_admin(admin_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('admin_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
     
     admin_to_edit = User.query.get_or_404(admin_id)
-    current_user = User.query.get(session['user_id'])
     
     # Prevent editing super admin or self-editing restrictions
     if admin_to_edit.is_super_admin:
@@ -147,20 +150,19 @@ def delete_admin(admin_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('admin_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
     
     admin_to_delete = User.query.get_or_404(admin_id)
-    current_user = User.query.get(session['user_id'])
     
     # Prevent deleting super admin or self
     if admin_to_delete.is_super_admin:
         flash('Cannot delete super admin user.', 'danger')
         return redirect(url_for('admin.admin_m'))
     
-    if admin_to_delete.id == current_user.id:
+    if admin_to_delete.id == user.id:
         flash('Cannot delete your own account.', 'danger')
         return redirect(url_for('admin.admin_m'))
     
@@ -175,13 +177,148 @@ def delete_admin(admin_id):
     
     return redirect(url_for('admin.admin_m'))
 
+@admin_bp.route('/admin/payroll/run', methods=['POST'])
+def run_payroll():
+    # Check permission
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    try:
+        year, month = payroll.parse_month_strict(request.form.get('month') or request.args.get('month'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        run = payroll.run_payroll(year, month, created_by=user.id)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(e)
+        return jsonify({'error': 'Payroll run failed'}), 500
+    
+    return jsonify(run.to_dict())
+
+@admin_bp.route('/admin/payroll/close', methods=['POST'])
+def close_payroll_month():
+    # Check permission
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    month_value = request.form.get('month') or request.args.get('month')
+    if not month_value:
+        return jsonify({'error': 'Month is required (YYYY-MM)'}), 400
+    
+    try:
+        year, month = payroll.parse_month_strict(month_value)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        written = payroll.close_month(year, month, closed_by=user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(e)
+        return jsonify({'error': 'Closing the month failed'}), 500
+    
+    return jsonify({'year': year, 'month': month, 'snapshots_written': written})
+
+@admin_bp.route('/admin/payroll/runs/<int:run_id>')
+def get_payroll_run(run_id):
+    # Check permission
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    run = PayrollRun.query.get_or_404(run_id)
+    result = run.to_dict()
+    result['lines'] = [line.to_dict() for line in run.lines]
+    return jsonify(result)
+
+@admin_bp.route('/admin/import/entries', methods=['POST'])
+def import_entries():
+    """Import historical labour entries from an uploaded CSV (see importers.py for the columns)"""
+    # Check permission
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'A CSV file is required'}), 400
+    
+    token, rejects_path = importers.new_rejects_path()
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    
+    try:
+        result = importers.import_entries(stream, rejects_path, default_employee=request.form.get('employee') or None)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.exception(e)
+        return jsonify({'error': 'Import failed; nothing was imported'}), 500
+    
+    response = result.to_dict()
+    if result.rejects_path:
+        response['rejects_url'] = url_for('admin.download_import_rejects', token=token)
+    return jsonify(response)
+
+@admin_bp.route('/admin/import/rejected/<token>')
+def download_import_rejects(token):
+    # Check permission
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        flash('You do not have permission to access this page.', 'danger')
+        return redirect(url_for('admin.admin_dashboard'))
+    
+    if not re.fullmatch(r'[0-9a-f]{32}', token):
+        abort(404)
+    rejects_path = os.path.join(importers.import_dir(), f'{token}.rejected.csv')
+    if not os.path.exists(rejects_path):
+        abort(404)
+    
+    return send_file(rejects_path, mimetype='text/csv', as_attachment=True, download_name='rejected_rows.csv')
+
+@admin_bp.route('/admin/throttle/stats')
+def throttle_stats():
+    """Login throttle counters of the worker serving this request"""
+    # Check permission
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('admin_m'):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    return jsonify(throttle.login_throttle().stats())
+
 # API endpoint to get current user permissions (useful for frontend)
 @admin_bp.route('/api/user-permissions')
 def get_user_permissions():
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
+    if not user:
+        return jsonify({'error': 'Not logged in'}), 401
+    
     permissions = {
         'site_m': user.has_permission('site_m'),
         'employee_m': user.has_permission('employee_m'),
@@ -198,7 +335,7 @@ def list_admins():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('admin_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -1,7 +1,11 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from models import db, User, Site, Labour, Employee, LabourEntry  
 from config import Config
+import auth
+import cache
+import throttle
 from functools import wraps
 
 # Import blueprints
@@ -10,13 +14,24 @@ from site_m import site_bp
 from labour import labour_bp
 from employee import employee_bp
 from report import report_bp
+from summary import summary_cli
+from payroll import payroll_cli
+from importers import import_cli
+from counters import counters_cli
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    # Behind reverse proxies, take the client IP (used by the login throttle) from X-Forwarded-For
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
+
     db.init_app(app)
     migrate = Migrate(app, db)
+    cache.init_app(app)
+    auth.init_app(app)
+    throttle.init_app(app)
 
     # Register blueprints
     app.register_blueprint(admin_bp)
@@ -25,6 +40,13 @@ def create_app():
     app.register_blueprint(employee_bp) 
     app.register_blueprint(report_bp)
 
+    # Register CLI commands
+    app.cli.add_command(summary_cli)
+    app.cli.add_command(payroll_cli)
+    app.cli.add_command(import_cli)
+    app.cli.add_command(counters_cli)
+    app.cli.add_command(auth.auth_cli)
+
     def login_required(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -40,7 +62,7 @@ def create_app():
                 if 'user_id' not in session:
                     return redirect(url_for('login'))
                 
-                user = User.query.get(session['user_id'])
+                user = auth.current_user()
                 if not user or not user.has_permission(permission):
                     flash('You do not have permission to access this page.', 'danger')
                     return redirect(url_for('admin.admin_dashboard'))
@@ -63,74 +85,31 @@ def create_app():
             username = request.form['username']
             password = request.form['password']
             
-            # Debug: Print what we're looking for
-            print(f"DEBUG: Attempting login with username: {username}")
-            
-            # First check if it's an admin user
-            user = User.query.filter_by(username=username).first()
-            
-            if user:
-                print(f"DEBUG: Admin user found - ID: {user.id}, Username: {user.username}")
-                
-                if user.check_password(password):
-                    session['user_id'] = user.id
-                    session['user_type'] = 'admin'  # Mark as admin
-                    print(f"DEBUG: Admin login successful for user {username}")
-                    return redirect(url_for('admin.admin_dashboard'))
-                else:
-                    print(f"DEBUG: Password validation failed for admin user {username}")
-            else:
-                # Try to find by email (in case they're using email to login)
-                user_by_email = User.query.filter_by(email=username).first()
-                if user_by_email:
-                    print(f"DEBUG: Found admin user by email instead: {user_by_email.username}")
-                    if user_by_email.check_password(password):
-                        session['user_id'] = user_by_email.id
-                        session['user_type'] = 'admin'  # Mark as admin
-                        print(f"DEBUG: Admin login successful via email for user {user_by_email.username}")
-                        return redirect(url_for('admin.admin_dashboard'))
-                    else:
-                        print(f"DEBUG: Password validation failed via email for admin user {user_by_email.username}")
+            # Rejected here, before any database lookup or password hash
+            retry_after = throttle.login_throttle().check(request.remote_addr, username)
+            if retry_after:
+                flash(f'Too many login attempts. Please try again in {int(retry_after) + 1} seconds.', 'danger')
+                return render_template('login.html'), 429, {'Retry-After': str(int(retry_after) + 1)}
             
-            # If not found in admin users, check employee table
-            employee = Employee.query.filter_by(username=username).first()
+            # One query finds every admin, employee or labour account the identifier names
+            try:
+                credential, inactive = auth.authenticate(username, password)
+            except auth.VerifierBusy:
+                flash('Too many login attempts right now. Please try again in a moment.', 'danger')
+                return render_template('login.html'), 503
             
-            if employee:
-                print(f"DEBUG: Employee found - ID: {employee.id}, Username: {employee.username}")
-                
-                if not employee.is_active:
-                    flash('Your account is inactive. Please contact administrator.', 'danger')
-                    return render_template('login.html')
-                
-                if employee.check_password(password):
-                    session['user_id'] = employee.id
-                    session['user_type'] = 'employee'  # Mark as employee
-                    print(f"DEBUG: Employee login successful for user {username}")
-                    return redirect(url_for('employee.entry'))
-                else:
-                    print(f"DEBUG: Password validation failed for employee user {username}")
-            else:
-                print(f"DEBUG: No employee found with username: {username}")
+            if not credential:
+                throttle.login_throttle().record_failure(username)
             
-            # If not found in admin or employee, check labour table
-            labour = Labour.query.filter_by(labour_id=username).first()
+            if inactive:
+                flash('Your account is inactive. Please contact administrator.', 'danger')
+                return render_template('login.html')
             
-            if labour:
-                print(f"DEBUG: Labour found - ID: {labour.id}, Labour ID: {labour.labour_id}")
-                
-                if not labour.is_active:
-                    flash('Your account is inactive. Please contact administrator.', 'danger')
-                    return render_template('login.html')
-                
-                if labour.check_password(password):
-                    session['user_id'] = labour.id
-                    session['user_type'] = 'labour'  # Mark as labour
-                    print(f"DEBUG: Labour login successful for user {username}")
-                    return redirect(url_for('labour.wage_card'))
-                else:
-                    print(f"DEBUG: Password validation failed for labour user {username}")
-            else:
-                print(f"DEBUG: No labour found with labour_id: {username}")
+            if credential:
+                throttle.login_throttle().record_success(request.remote_addr)
+                session['user_id'] = credential.id
+                session['user_type'] = credential.user_type  # admin / employee / labour
+                return redirect(url_for(auth.LANDING_ENDPOINTS[credential.user_type]))
             
             flash('Invalid credentials', 'danger')
         
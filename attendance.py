@@ -0,0 +1,239 @@
+"""
+Per-month attendance bitmaps for labourers.
+
+Each (labour, site, month) row holds two 32-bit masks where bit (day - 1)
+is set when the labourer had a Present entry on that day (present_mask),
+or had entries but none of them Present (absent_mask). That is the same
+"explicitly absent" rule payroll.compute_month_bulk() and compute_history()
+apply to the rollup (present_count == 0 on a day with entries). The masks are derived from the daily
+summary rollup and refreshed whenever summary.apply_entries() runs, so
+monthly attendance becomes a handful of popcounts.
+"""
+from calendar import monthrange
+from datetime import date
+
+from sqlalchemy import func, case, cast, tuple_, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, LabourDailySummary, LabourAttendanceMonth
+
+
+def day_bit(day):
+    """Bit of a day of the month (1-31) within a mask"""
+    return 1 << (day - 1)
+
+
+def popcount(mask):
+    return bin(mask or 0).count('1')
+
+
+def month_start_of(value):
+    return value.replace(day=1)
+
+
+def _month_masks_select(keys=None, date_from=None, date_to=None):
+    """Select (labour_id, site_id, month_start, present_mask, absent_mask) from the rollup"""
+    daily = db.session.query(
+        LabourDailySummary.labour_id,
+        LabourDailySummary.site_id,
+        LabourDailySummary.work_date,
+        func.sum(LabourDailySummary.present_count).label('present_count')
+    )
+    if keys:
+        months = [month for _, _, month in keys]
+        _, last_days = monthrange(max(months).year, max(months).month)
+        daily = daily.filter(
+            tuple_(LabourDailySummary.labour_id, LabourDailySummary.site_id).in_(
+                list({(labour_id, site_id) for labour_id, site_id, _ in keys})
+            ),
+            LabourDailySummary.work_date >= min(months),
+            LabourDailySummary.work_date <= max(months).replace(day=last_days)
+        )
+    if date_from:
+        daily = daily.filter(LabourDailySummary.work_date >= date_from)
+    if date_to:
+        daily = daily.filter(LabourDailySummary.work_date <= date_to)
+    daily = daily.group_by(
+        LabourDailySummary.labour_id, LabourDailySummary.site_id, LabourDailySummary.work_date
+    ).subquery()
+
+    month_start = cast(func.date_trunc('month', daily.c.work_date), db.Date)
+    bit = literal(1).op('<<')(cast(func.extract('day', daily.c.work_date), db.Integer) - 1)
+
+    query = db.session.query(
+        daily.c.labour_id,
+        daily.c.site_id,
+        month_start.label('month_start'),
+        func.bit_or(case((daily.c.present_count > 0, bit), else_=0)).label('present_mask'),
+        func.bit_or(case((daily.c.present_count == 0, bit), else_=0)).label('absent_mask')
+    )
+    if keys:
+        query = query.filter(tuple_(daily.c.labour_id, daily.c.site_id, month_start).in_(list(keys)))
+
+    return query.group_by(daily.c.labour_id, daily.c.site_id, month_start)
+
+
+def _upsert_from(select_query):
+    statement = pg_insert(LabourAttendanceMonth).from_select(
+        ['labour_id', 'site_id', 'month_start', 'present_mask', 'absent_mask'],
+        select_query.statement
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=['labour_id', 'site_id', 'month_start'],
+        set_={
+            'present_mask': statement.excluded.present_mask,
+            'absent_mask': statement.excluded.absent_mask
+        }
+    )
+    db.session.execute(statement)
+
+
+def refresh(keys):
+    """
+    Recompute the masks of the given (labour_id, site_id, month_start) keys.
+
+    Runs in the caller's transaction, after the rollup has been updated.
+    The key rows are created if missing and locked first (in key order), so
+    two transactions refreshing the same month wait for each other instead
+    of the later upsert overwriting the earlier one's days.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return
+
+    key_columns = (LabourAttendanceMonth.labour_id, LabourAttendanceMonth.site_id, LabourAttendanceMonth.month_start)
+    key_filter = tuple_(*key_columns).in_(keys)
+
+    db.session.execute(pg_insert(LabourAttendanceMonth).values([
+        {'labour_id': labour_id, 'site_id': site_id, 'month_start': month_start, 'present_mask': 0, 'absent_mask': 0}
+        for labour_id, site_id, month_start in keys
+    ]).on_conflict_do_nothing(index_elements=['labour_id', 'site_id', 'month_start']))
+    db.session.query(*key_columns).filter(key_filter).order_by(*key_columns).with_for_update().all()
+
+    # Clear first so months whose last entry was removed end up empty
+    db.session.query(LabourAttendanceMonth).filter(key_filter).update(
+        {'present_mask': 0, 'absent_mask': 0}, synchronize_session=False
+    )
+    _upsert_from(_month_masks_select(keys=keys))
+    db.session.query(LabourAttendanceMonth).filter(
+        key_filter,
+        LabourAttendanceMonth.present_mask == 0,
+        LabourAttendanceMonth.absent_mask == 0
+    ).delete(synchronize_session=False)
+
+
+def rebuild(date_from=None, date_to=None):
+    """Recompute every month overlapping [date_from, date_to] from the rollup"""
+    month_from = month_start_of(date_from) if date_from else None
+    month_to = date_to.replace(day=monthrange(date_to.year, date_to.month)[1]) if date_to else None
+
+    delete_query = db.session.query(LabourAttendanceMonth)
+    if month_from:
+        delete_query = delete_query.filter(LabourAttendanceMonth.month_start >= month_from)
+    if month_to:
+        delete_query = delete_query.filter(LabourAttendanceMonth.month_start <= month_to)
+    delete_query.delete(synchronize_session=False)
+
+    _upsert_from(_month_masks_select(date_from=month_from, date_to=month_to))
+
+
+def labour_month_masks(labour_id, month_start):
+    """Return (present_mask, absent_mask) of a labourer for a month, across all sites"""
+    row = db.session.query(
+        func.coalesce(func.bit_or(LabourAttendanceMonth.present_mask), 0),
+        func.coalesce(func.bit_or(LabourAttendanceMonth.absent_mask), 0)
+    ).filter(
+        LabourAttendanceMonth.labour_id == labour_id,
+        LabourAttendanceMonth.month_start == month_start
+    ).one()
+    return row[0], row[1]
+
+
+def attendance_counts(present_mask, absent_mask):
+    """
+    Count (present_days, explicitly_absent, days_with_entries) from masks.
+
+    A day with any Present entry counts as present even if it also has
+    Absent entries.
+    """
+    return (
+        popcount(present_mask),
+        popcount(absent_mask & ~present_mask),
+        popcount(present_mask | absent_mask)
+    )
+
+
+def _months_between(month_from, month_to):
+    months = []
+    current = month_start_of(month_from)
+    while current <= month_to:
+        months.append(current)
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+    return months
+
+
+def labour_calendar(labour_id, month_from, month_to):
+    """
+    Day-by-day attendance of a labourer for every month in a range.
+
+    Returns a list of {'month': 'YYYY-MM', 'days': [...]} where each day is
+    'present', 'absent' or None (no entries).
+    """
+    rows = db.session.query(
+        LabourAttendanceMonth.month_start,
+        func.bit_or(LabourAttendanceMonth.present_mask),
+        func.bit_or(LabourAttendanceMonth.absent_mask)
+    ).filter(
+        LabourAttendanceMonth.labour_id == labour_id,
+        LabourAttendanceMonth.month_start.between(month_start_of(month_from), month_to)
+    ).group_by(LabourAttendanceMonth.month_start).all()
+    masks = {month_start: (present_mask, absent_mask) for month_start, present_mask, absent_mask in rows}
+
+    calendar = []
+    for month_start in _months_between(month_from, month_to):
+        present_mask, absent_mask = masks.get(month_start, (0, 0))
+        _, days_in_month = monthrange(month_start.year, month_start.month)
+        days = []
+        for day in range(1, days_in_month + 1):
+            bit = day_bit(day)
+            days.append('present' if present_mask & bit else 'absent' if absent_mask & bit else None)
+        calendar.append({'month': month_start.strftime('%Y-%m'), 'days': days})
+    return calendar
+
+
+def site_calendar(site_id, month_from, month_to):
+    """
+    Daily present/absent labourer counts of a site for every month in a range.
+
+    Returns a list of {'month': 'YYYY-MM', 'present': [...], 'absent': [...]}
+    with one count per day of the month.
+    """
+    rows = db.session.query(
+        LabourAttendanceMonth.month_start,
+        LabourAttendanceMonth.present_mask,
+        LabourAttendanceMonth.absent_mask
+    ).filter(
+        LabourAttendanceMonth.site_id == site_id,
+        LabourAttendanceMonth.month_start.between(month_start_of(month_from), month_to)
+    ).all()
+
+    counts = {}
+    for month_start, present_mask, absent_mask in rows:
+        present, absent = counts.setdefault(month_start, ([0] * 31, [0] * 31))
+        for day in range(31):
+            bit = 1 << day
+            if present_mask & bit:
+                present[day] += 1
+            elif absent_mask & bit:
+                absent[day] += 1
+
+    calendar = []
+    for month_start in _months_between(month_from, month_to):
+        _, days_in_month = monthrange(month_start.year, month_start.month)
+        present, absent = counts.get(month_start, ([0] * 31, [0] * 31))
+        calendar.append({
+            'month': month_start.strftime('%Y-%m'),
+            'present': present[:days_in_month],
+            'absent': absent[:days_in_month]
+        })
+    return calendar
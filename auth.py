@@ -0,0 +1,326 @@
+"""
+Credential lookup for /login and the logged-in admin principal.
+
+A login identifier may name an admin (by username or email), an employee
+(by username) or a labourer (by labour ID). resolve_principal() finds every
+account it could name with a single UNION ALL query, each branch served
+by the unique index on its column, and returns them in login priority
+order.
+
+Password hashes are verified on a bounded thread pool rather than the
+request thread (hashlib's scrypt and PBKDF2 release the GIL, so the pool
+runs them in parallel), and a hash whose method differs from
+PASSWORD_HASH_METHODS for its principal type is upgraded after a
+successful login.
+
+Views get the logged-in admin from current_user(): a read-only Principal
+snapshot memoized on flask.g for the request and cached across requests,
+keyed by the user's permissions_version column. That column is read on
+every request with a primary-key lookup, so an edit or delete made on any
+worker takes effect on the next request everywhere.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import click
+from flask import current_app, g, session
+from flask.cli import AppGroup
+from sqlalchemy import literal, true, union_all, select
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import get_cache
+from models import db, User, Employee, Labour
+
+# matched_on: 'username' or 'email' for admins, 'username' for employees, 'labour_id' for labourers
+Credential = namedtuple('Credential', ['user_type', 'id', 'password_hash', 'is_active', 'matched_on'])
+
+PRINCIPAL_MODELS = {
+    'admin': User,
+    'employee': Employee,
+    'labour': Labour
+}
+
+# Where each principal type lands after logging in
+LANDING_ENDPOINTS = {
+    'admin': 'admin.admin_dashboard',
+    'employee': 'employee.entry',
+    'labour': 'labour.wage_card'
+}
+
+
+class VerifierBusy(Exception):
+    """Raised when the password verification pool is saturated"""
+
+
+class PasswordVerifier:
+    """
+    Bounded thread pool for password hash checks.
+
+    At most `workers` hashes run at once and at most `queue_size` more may
+    wait; beyond that callers wait up to `timeout` seconds for a slot and
+    then get VerifierBusy, so a login burst cannot pile up unbounded work.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-verify')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.timeout = timeout
+
+    def _run(self, function, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise VerifierBusy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password, method):
+        return self._run(generate_password_hash, password, method)
+
+
+def init_app(app):
+    """Create the password verification pool of an app"""
+    app.extensions['auth'] = PasswordVerifier(
+        app.config['PASSWORD_VERIFY_WORKERS'] or os.cpu_count() or 1,
+        app.config['PASSWORD_VERIFY_QUEUE'],
+        app.config['PASSWORD_VERIFY_TIMEOUT']
+    )
+
+
+def verifier():
+    return current_app.extensions['auth']
+
+
+_method_prefixes = {}
+
+
+def hash_method_prefix(method):
+    """The 'method$' prefix werkzeug writes for a configured method, e.g. 'scrypt' -> 'scrypt:32768:8:1'"""
+    if method not in _method_prefixes:
+        _method_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return _method_prefixes[method]
+
+
+def needs_rehash(credential):
+    """True when a hash was made with other parameters than its principal type is configured for"""
+    method = current_app.config['PASSWORD_HASH_METHODS'][credential.user_type]
+    return credential.password_hash.split('$', 1)[0] != hash_method_prefix(method)
+
+
+def rehash(credential, password):
+    """Store a hash of `password` made with the configured method; failures only get logged"""
+    method = current_app.config['PASSWORD_HASH_METHODS'][credential.user_type]
+    model = PRINCIPAL_MODELS[credential.user_type]
+    try:
+        password_hash = verifier().hash(password, method)
+        db.session.query(model).filter(
+            model.id == credential.id,
+            model.password_hash == credential.password_hash  # skip if changed meanwhile
+        ).update({'password_hash': password_hash}, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(e)
+
+
+def _branch(priority, user_type, matched_on, model, column, is_active, identifier):
+    return select(
+        literal(priority).label('priority'),
+        literal(user_type).label('user_type'),
+        model.id.label('id'),
+        model.password_hash.label('password_hash'),
+        is_active.label('is_active'),
+        literal(matched_on).label('matched_on')
+    ).where(column == identifier)
+
+
+def resolve_principal(identifier):
+    """Return the Credentials an identifier could log in as, highest priority first"""
+    query = union_all(
+        _branch(0, 'admin', 'username', User, User.username, true(), identifier),
+        _branch(1, 'admin', 'email', User, User.email, true(), identifier),
+        _branch(2, 'employee', 'username', Employee, Employee.username, Employee.is_active, identifier),
+        _branch(3, 'labour', 'labour_id', Labour, Labour.labour_id, Labour.is_active, identifier)
+    ).subquery()
+
+    rows = db.session.execute(
+        select(query.c.user_type, query.c.id, query.c.password_hash, query.c.is_active, query.c.matched_on)
+        .order_by(query.c.priority)
+    ).all()
+    return [Credential(*row) for row in rows]
+
+
+def authenticate(identifier, password):
+    """
+    Check a login attempt against the accounts the identifier names.
+
+    Follows the login rules: an admin username match shadows an email
+    match, a wrong password falls through to the next account type, and an
+    inactive employee or labourer stops the attempt.
+
+    Hashes are checked on the verification pool (VerifierBusy is raised
+    when it is saturated) and upgraded to the configured method on success.
+
+    Returns (credential, inactive): the Credential that logged in (or None)
+    and whether the attempt hit an inactive account.
+    """
+    candidates = resolve_principal(identifier)
+    username_match = any(c.user_type == 'admin' and c.matched_on == 'username' for c in candidates)
+
+    for candidate in candidates:
+        if candidate.matched_on == 'email' and username_match:
+            continue
+        if not candidate.is_active:
+            return None, True
+        if verifier().verify(candidate.password_hash, password):
+            if needs_rehash(candidate):
+                rehash(candidate, password)
+            return candidate, False
+
+    return None, False
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Read-only snapshot of an admin User: what views and templates need for permission checks"""
+    id: int
+    username: str
+    email: str
+    is_super_admin: bool
+    can_access_site_m: bool
+    can_access_employee_m: bool
+    can_access_labour_m: bool
+    can_access_admin_m: bool
+    permissions_version: int
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_super_admin=bool(user.is_super_admin),
+            can_access_site_m=bool(user.can_access_site_m),
+            can_access_employee_m=bool(user.can_access_employee_m),
+            can_access_labour_m=bool(user.can_access_labour_m),
+            can_access_admin_m=bool(user.can_access_admin_m),
+            permissions_version=user.permissions_version or 0
+        )
+
+    def has_permission(self, permission):
+        """Same rules as User.has_permission"""
+        if self.is_super_admin:
+            return True
+        return {
+            'site_m': self.can_access_site_m,
+            'employee_m': self.can_access_employee_m,
+            'labour_m': self.can_access_labour_m,
+            'admin_m': self.can_access_admin_m,
+        }.get(permission, False)
+
+
+def _load_principal():
+    if session.get('user_type') != 'admin' or 'user_id' not in session:
+        return None
+
+    user_id = session['user_id']
+    # The authoritative version lives in the users row; a deleted admin has no row
+    row = db.session.query(User.permissions_version).filter(User.id == user_id).first()
+    if row is None:
+        return None
+
+    principal_cache = get_cache(
+        'principals',
+        maxsize=current_app.config['PRINCIPAL_CACHE_SIZE'],
+        ttl=current_app.config['PRINCIPAL_CACHE_TTL']
+    )
+    key = f'{user_id}:{row.permissions_version or 0}'
+
+    principal = principal_cache.get(key)
+    if principal is None:
+        user = User.query.get(user_id)
+        if not user:
+            return None
+        principal = Principal.from_user(user)
+        principal_cache.set(f'{user_id}:{principal.permissions_version}', principal)
+
+    return principal
+
+
+def current_user():
+    """
+    The logged-in admin as a Principal, or None (not logged in, not an
+    admin session, or the user no longer exists).
+
+    Memoized on flask.g, so a request makes one primary-key lookup of the
+    user's permissions_version, plus a full users query only when the
+    principal cache does not hold that version yet.
+    """
+    if 'principal' not in g:
+        g.principal = _load_principal()
+    return g.principal
+
+
+auth_cli = AppGroup('auth', help='Authentication tools.')
+
+
+def _run_logins(check, attempts, threads):
+    """Run `attempts` calls of check() on `threads` client threads; returns elapsed seconds"""
+    remaining = iter(range(attempts))
+    lock = threading.Lock()
+    app = current_app._get_current_object()
+
+    def client():
+        with app.app_context():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                check()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+@auth_cli.command('bench-login')
+@click.option('--attempts', default=200, show_default=True, help='Logins per measurement.')
+@click.option('--threads', default=8, show_default=True, help='Concurrent client threads.')
+@click.option('--user-type', type=click.Choice(sorted(PRINCIPAL_MODELS)), default='labour', show_default=True,
+              help='Principal type whose configured hash method is measured.')
+@click.option('--identifier', help='Also measure full logins (query + verify) for this account...')
+@click.option('--password', help='...with this password.')
+def bench_login_command(attempts, threads, user_type, identifier, password):
+    """Measure password verification throughput inline and on the verification pool."""
+    method = current_app.config['PASSWORD_HASH_METHODS'][user_type]
+    sample_hash = generate_password_hash('benchmark-password', method=method)
+    cores = os.cpu_count() or 1
+
+    def report(label, seconds):
+        rate = attempts / seconds
+        click.echo(f'{label:<28} {rate:8.1f} logins/s  {rate / cores:7.1f} logins/s/core')
+
+    click.echo(f'{attempts} logins, {threads} client threads, {cores} cores, method {hash_method_prefix(method)}')
+    report('inline (request thread)', _run_logins(
+        lambda: check_password_hash(sample_hash, 'benchmark-password'), attempts, threads
+    ))
+    report('verification pool', _run_logins(
+        lambda: verifier().verify(sample_hash, 'benchmark-password'), attempts, threads
+    ))
+
+    if identifier and password:
+        def full_login():
+            authenticate(identifier, password)
+            db.session.remove()
+        report('full login (query + pool)', _run_logins(full_login, attempts, threads))
@@ -0,0 +1,260 @@
+"""
+Result caching shared by the reporting and wage views.
+
+Each named cache is an in-process LRU with a TTL, optionally backed by a
+shared store (filesystem or Redis) so several workers can reuse results.
+Invalidation is driven by version counters: writers bump a counter and
+readers fold the current counter values into their cache keys, so stale
+entries are simply never looked up again and age out of the LRU.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL"""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileSystemBackend:
+    """Shared cache stored as pickled files in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as handle:
+                expires_at, value = pickle.load(handle)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        temp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as handle:
+            pickle.dump((expires_at, value), handle)
+        os.replace(temp_path, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key):
+        with open(self._path(key) + '.lock', 'a+b') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                value = (self.get(key) or 0) + 1
+                self.set(key, value)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return value
+
+
+class RedisBackend:
+    """Shared cache stored in Redis (requires the optional redis package)"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('CACHE_BACKEND=redis requires the "redis" package') from e
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return [pickle.loads(raw) if raw is not None else None for raw in self.client.mget(keys)]
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        # Counters are stored as raw integers by INCR, not pickled
+        return self.client.incr(key)
+
+
+class Cache:
+    """A named in-process LRU in front of the optional shared backend"""
+
+    def __init__(self, namespace, backend=None, maxsize=256, ttl=300):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def _key(self, key):
+        return f'{self.namespace}:{key}'
+
+    def get(self, key):
+        key = self._key(key)
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        key = self._key(key)
+        self.local.set(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, ttl=self.ttl)
+
+    def delete(self, key):
+        key = self._key(key)
+        self.local.delete(key)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+
+class VersionCounters:
+    """Monotonic invalidation counters, shared across workers when a backend is set"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._local = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        """True when bumps reach every worker; memory counters only change in this process"""
+        return self.backend is not None
+
+    def get_many(self, keys):
+        keys = [f'version:{key}' for key in keys]
+        if self.backend is None:
+            with self._lock:
+                return [self._local.get(key, 0) for key in keys]
+        if isinstance(self.backend, RedisBackend):
+            return [int(raw or 0) for raw in self.backend.client.mget(keys)] if keys else []
+        return [value or 0 for value in self.backend.get_many(keys)]
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def bump(self, keys):
+        for key in set(keys):
+            key = f'version:{key}'
+            if self.backend is None:
+                with self._lock:
+                    self._local[key] = self._local.get(key, 0) + 1
+            else:
+                self.backend.incr(key)
+
+    def digest(self, keys):
+        """Hash the current values of many counters into a short cache key part"""
+        values = ','.join(str(value) for value in self.get_many(keys))
+        return hashlib.sha1(values.encode('ascii')).hexdigest()[:16]
+
+
+def _create_backend(app):
+    backend = app.config.get('CACHE_BACKEND', 'memory')
+    if backend == 'filesystem':
+        return FileSystemBackend(app.config['CACHE_DIR'])
+    if backend == 'redis':
+        return RedisBackend(app.config['CACHE_REDIS_URL'])
+    return None
+
+
+def init_app(app):
+    """Set up the shared backend, named caches and version counters for an app"""
+    backend = _create_backend(app)
+    app.extensions['cache'] = {
+        'backend': backend,
+        'caches': {},
+        'versions': VersionCounters(backend),
+        'lock': threading.Lock()
+    }
+
+
+def get_cache(namespace, maxsize=256, ttl=300):
+    """Return the named cache of the current app, creating it on first use"""
+    state = current_app.extensions['cache']
+    with state['lock']:
+        cache = state['caches'].get(namespace)
+        if cache is None:
+            cache = Cache(namespace, backend=state['backend'], maxsize=maxsize, ttl=ttl)
+            state['caches'][namespace] = cache
+        return cache
+
+
+def versions():
+    """Return the version counters of the current app"""
+    return current_app.extensions['cache']['versions']
@@ -0,0 +1,110 @@
+"""
+Dashboard counters.
+
+The admin dashboard reads its totals from the small dashboard_counters
+table instead of running COUNT(*) over labour, employees and sites. Every
+create/delete path adjusts the matching counter inside its own
+transaction.
+
+Today's present/absent labourers are not maintained: a shared per-day row
+would serialize every entry write on one lock. They are counted at read
+time from the daily rollup, whose primary key starts with work_date.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, local_date, Labour, Employee, Site, LabourDailySummary, DashboardCounter
+
+# Counter name -> model whose rows it counts
+TOTALS = {
+    'labour': Labour,
+    'employees': Employee,
+    'sites': Site
+}
+
+
+def _store(values):
+    statement = pg_insert(DashboardCounter).values(
+        [{'name': name, 'value': value} for name, value in values.items()]
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['name'], set_={'value': statement.excluded.value}
+    ))
+
+
+def adjust(name, delta):
+    """
+    Add delta to one of the TOTALS counters.
+
+    Runs in the caller's transaction, so the counter commits or rolls back
+    together with the rows it counts. A counter that does not exist yet is
+    left alone; get_dashboard_counts() builds it from COUNT(*) on first use.
+    """
+    if delta:
+        db.session.query(DashboardCounter).filter(DashboardCounter.name == name).update(
+            {DashboardCounter.value: DashboardCounter.value + delta}, synchronize_session=False
+        )
+
+
+def rebuild():
+    """Recompute every counter with COUNT(*)"""
+    _store({name: model.query.count() for name, model in TOTALS.items()})
+
+
+def attendance_on(day):
+    """
+    Return (present, absent) labourer counts of a day: labourers with a
+    Present entry, and labourers whose entries that day are all non-present
+    """
+    per_labour = db.session.query(
+        func.sum(LabourDailySummary.present_count).label('present_count')
+    ).filter(
+        LabourDailySummary.work_date == day
+    ).group_by(LabourDailySummary.labour_id).subquery()
+
+    present, absent = db.session.query(
+        func.count().filter(per_labour.c.present_count > 0),
+        func.count().filter(per_labour.c.present_count == 0)
+    ).one()
+    return present, absent
+
+
+def get_dashboard_counts(day=None):
+    """
+    Return {'total_labour', 'total_employees', 'active_sites', 'present_today',
+    'absent_today'}: the totals with one primary-key lookup and the day's
+    labourer counts with one index range over the daily rollup.
+
+    Counters that have never been written (e.g. right after deploying) are
+    rebuilt once.
+    """
+    values = dict(db.session.query(DashboardCounter.name, DashboardCounter.value).filter(
+        DashboardCounter.name.in_(list(TOTALS))
+    ).all())
+
+    if not all(name in values for name in TOTALS):
+        rebuild()
+        db.session.commit()
+        return get_dashboard_counts(day)
+
+    present, absent = attendance_on(day or local_date())
+    return {
+        'total_labour': values['labour'],
+        'total_employees': values['employees'],
+        'active_sites': values['sites'],
+        'present_today': present,
+        'absent_today': absent
+    }
+
+
+counters_cli = AppGroup('counters', help='Maintain the admin dashboard counters.')
+
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the dashboard counters from the source tables."""
+    rebuild()
+    db.session.commit()
+    click.echo('Dashboard counters rebuilt.')
@@ -1,18 +1,187 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
-from models import db, User, Site, Employee, Labour, LabourEntry
-from sqlalchemy import func
-from datetime import date
+from models import db, local_date, Site, Employee, Labour, LabourEntry
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import datetime, timedelta, timezone
+import uuid
+import auth
+import counters
+import summary
+import invalidation
+import payroll
 
 # Create blueprint
 employee_bp = Blueprint('employee', __name__)
 
+ACTIVITIES = [
+    "Corner Bead", "Plaster", "Spot Level", "Conduit Filling",
+    "Keycoat", "Mesh Fixing", "Mesh Filling", "Fiber Mesh Fixing"
+]
+STATUSES = ('Present', 'Absent')
+RATE_TYPES = ('Unit', 'Hour')
+MAX_BULK_ENTRIES = 500
+MAX_SYNC_ENTRIES = 2000
+MAX_CLIENT_KEY_LENGTH = 64
+CLOCK_SKEW = timedelta(minutes=5)
+
+def _optional_float(value):
+    if value in (None, ''):
+        return None
+    return float(value)
+
+def parse_entry_values(data):
+    """
+    Validate one submitted labour entry (form fields or a JSON object).
+    
+    Returns (values, errors): the cleaned column values without the
+    labour/employee/site ids, and a list of human readable errors.
+    """
+    errors = []
+    
+    labour_code = str(data.get('labour_id') or '').strip()
+    if not labour_code:
+        errors.append('Labour ID is required.')
+    
+    activity = data.get('activity')
+    if activity not in ACTIVITIES:
+        errors.append('Activity is invalid.')
+    
+    status = data.get('status')
+    if status not in STATUSES:
+        errors.append('Status must be Present or Absent.')
+    
+    rate_type = data.get('rate_type')
+    if rate_type not in RATE_TYPES:
+        errors.append('Rate type must be Unit or Hour.')
+    
+    unit = data.get('unit')
+    if not unit:
+        errors.append('Unit is required.')
+    
+    try:
+        rate = float(data.get('rate') or 0)
+        total_hours = _optional_float(data.get('total_hours')) or None
+        qty = _optional_float(data.get('qty')) or None
+        amount = _optional_float(data.get('amount'))
+    except (TypeError, ValueError):
+        errors.append('Rate, hours, quantity and amount must be numbers.')
+        return None, errors
+    
+    if min(rate, total_hours or 0, qty or 0, amount or 0) < 0:
+        errors.append('Rate, hours, quantity and amount cannot be negative.')
+    
+    if amount is None:
+        amount = rate * ((total_hours if rate_type == 'Hour' else qty) or 0)
+    
+    values = {
+        'labour_code': labour_code,
+        'activity': activity,
+        'status': status,
+        'unit': unit,
+        'rate_type': rate_type,
+        'rate': rate,
+        'total_hours': total_hours,
+        'qty': qty,
+        'amount': round(amount, 2)
+    }
+    return values, errors
+
+def resolve_labour_codes(codes):
+    """Map labour codes to (id, is_active) with a single IN query"""
+    codes = {(code or '').strip() for code in codes} - {''}
+    if not codes:
+        return {}
+    rows = db.session.query(Labour.labour_id, Labour.id, Labour.is_active).filter(
+        Labour.labour_id.in_(codes)
+    ).all()
+    return {code: (labour_db_id, is_active) for code, labour_db_id, is_active in rows}
+
+def prepare_entries(employee, items):
+    """
+    Validate many submitted entries for an employee's site.
+    
+    Returns (rows, errors): insertable labour_entries dicts for the valid
+    items and one {'row', 'labour_id', 'errors'} dict per invalid item.
+    """
+    parsed = [parse_entry_values(item) for item in items]
+    labours = resolve_labour_codes(values['labour_code'] for values, _ in parsed if values)
+    now = datetime.utcnow()
+    work_date = local_date(now)
+    
+    rows, errors = [], []
+    for index, (values, item_errors) in enumerate(parsed):
+        if values:
+            labour = labours.get(values['labour_code'])
+            if values['labour_code'] and not labour:
+                item_errors.append('Labour ID not found.')
+            elif labour and not labour[1]:
+                item_errors.append('Labour is inactive.')
+        
+        if item_errors:
+            errors.append({
+                'row': index,
+                'labour_id': values['labour_code'] if values else items[index].get('labour_id'),
+                'errors': item_errors
+            })
+            continue
+        
+        row = dict(values, labour_id=labour[0], employee_id=employee.id, site_id=employee.site_id,
+                   timestamp=now, work_date=work_date)
+        del row['labour_code']
+        rows.append(row)
+    
+    return rows, errors
+
+def insert_entries(rows):
+    """
+    Insert labour_entries rows with one multi-row INSERT and update the rollup.
+    
+    Runs in the caller's transaction; returns the rollup snapshots so the
+    caller can invalidate caches after committing.
+    """
+    if not rows:
+        return []
+    db.session.execute(LabourEntry.__table__.insert().values(rows))
+    snapshots = [summary.values_row(row) for row in rows]
+    summary.apply_entries(added=snapshots)
+    return snapshots
+
+def _parse_recorded_at(value):
+    """Parse a device timestamp (ISO 8601) into naive UTC, as stored in labour_entries"""
+    recorded_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if recorded_at.tzinfo is not None:
+        recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if recorded_at > datetime.utcnow() + CLOCK_SKEW:
+        raise ValueError('in the future')
+    return recorded_at
+
+def upsert_entries(rows):
+    """
+    Insert rows carrying a client_key, skipping keys that are already stored.
+    
+    Uses one INSERT ... ON CONFLICT (client_key) DO NOTHING RETURNING, so
+    replayed rows are never counted twice. Runs in the caller's transaction
+    and only the newly inserted rows are applied to the rollup.
+    
+    Returns ({client_key: id} for the inserted rows, rollup snapshots).
+    """
+    if not rows:
+        return {}, []
+    statement = pg_insert(LabourEntry.__table__).values(rows)
+    statement = statement.on_conflict_do_nothing(index_elements=['client_key']).returning(
+        LabourEntry.__table__.c.id, LabourEntry.__table__.c.client_key
+    )
+    inserted = {client_key: entry_id for entry_id, client_key in db.session.execute(statement)}
+    snapshots = [summary.values_row(row) for row in rows if row['client_key'] in inserted]
+    summary.apply_entries(added=snapshots)
+    return inserted, snapshots
+
 @employee_bp.route('/employee_m', methods=['GET', 'POST'])
 def employee_m():
     # Check permission
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('employee_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -58,6 +227,7 @@ def employee_m():
                 new_employee.set_password(password)
                 
                 db.session.add(new_employee)
+                counters.adjust('employees', 1)
                 db.session.commit()
                 flash(f'Employee "{username}" has been added successfully to site "{site.name}".', 'success')
             
@@ -111,7 +281,7 @@ def delete_employee():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('employee_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -127,6 +297,7 @@ def delete_employee():
         username = employee.username  # Store username for flash message
         
         db.session.delete(employee)
+        counters.adjust('employees', -1)
         db.session.commit()
         
         flash(f'Employee "{username}" has been deleted successfully.', 'success')
@@ -144,7 +315,7 @@ def toggle_employee_status():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'})
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('employee_m'):
         return jsonify({'success': False, 'message': 'Permission denied'})
     
@@ -182,11 +353,7 @@ def entry():
     employee = Employee.query.get_or_404(session['user_id'])
 
     # Dropdown data
-    activities = [
-        "Corner Bead", "Plaster", "Spot Level", "Conduit Filling",
-        "Keycoat", "Mesh Fixing", "Mesh Filling", "Fiber Mesh Fixing"
-    ]
-    active_labours = Labour.query.filter_by(is_active=True).all()
+    activities = ACTIVITIES
 
     # ------------------------ POST  ------------------------
     if request.method == 'POST':
@@ -208,12 +375,24 @@ def entry():
                     return redirect(url_for('employee.entry'))
                 
                 # Get labour by labour_id string
-                labour_code = request.form.get('labour_id')
+                labour_code = (request.form.get('labour_id') or '').strip()
                 labour = Labour.query.filter_by(labour_id=labour_code).first()
                 if not labour:
                     flash('Labour ID not found.', 'error')
                     return redirect(url_for('employee.entry'))
                 
+                if request.form.get('status') not in STATUSES:
+                    flash('Status must be Present or Absent.', 'error')
+                    return redirect(url_for('employee.entry'))
+                
+                # Closed payroll months are frozen for both the old and the new labourer
+                month = (entry.work_date.year, entry.work_date.month)
+                if payroll.closed_months({(entry.labour_id, *month), (labour.id, *month)}):
+                    flash('This entry is in a closed payroll month and cannot be edited.', 'error')
+                    return redirect(url_for('employee.entry'))
+                
+                previous_row = summary.entry_row(entry)
+                
                 # Update entry fields
                 entry.labour_id = labour.id
                 entry.activity = request.form.get('activity')
@@ -225,7 +404,10 @@ def entry():
                 entry.qty = float(request.form.get('qty') or 0) or None
                 entry.amount = float(request.form.get('amount') or 0)
                 
+                updated_row = summary.entry_row(entry)
+                summary.apply_entries(added=[updated_row], removed=[previous_row])
                 db.session.commit()
+                invalidation.entries_changed([previous_row, updated_row])
                 flash('Labour entry updated successfully!', 'success')
                 
             except Exception as e:
@@ -237,15 +419,28 @@ def entry():
         
         else:
             # Handle add entry (existing code)
-            labour_code = request.form.get('labour_id')            
+            labour_code = (request.form.get('labour_id') or '').strip()
             labour = Labour.query.filter_by(labour_id=labour_code).first()
 
             if not labour:
                 flash('Labour ID not found.', 'error')
                 return redirect(url_for('employee.entry'))
 
+            if request.form.get('status') not in STATUSES:
+                flash('Status must be Present or Absent.', 'error')
+                return redirect(url_for('employee.entry'))
+
+            # A resubmitted form carries the same key as the original POST
+            client_key = (request.form.get('client_key') or '').strip()[:MAX_CLIENT_KEY_LENGTH] or None
+            if client_key and LabourEntry.query.filter_by(client_key=client_key).first():
+                flash('This labour entry was already recorded.', 'info')
+                return redirect(url_for('employee.entry'))
+
             # Build new entry
+            now = datetime.utcnow()
             new_entry = LabourEntry(
+                timestamp=now,
+                work_date=local_date(now),
                 labour_id=labour.id,
                 employee_id=employee.id,
                 site_id=employee.site_id,
@@ -256,12 +451,17 @@ def entry():
                 rate=float(request.form.get('rate') or 0),
                 total_hours=float(request.form.get('total_hours') or 0) or None,
                 qty=float(request.form.get('qty') or 0) or None,
-                amount=float(request.form.get('amount') or 0)
+                amount=float(request.form.get('amount') or 0),
+                client_key=client_key
             )
 
             try:
                 db.session.add(new_entry)
+                db.session.flush()
+                new_row = summary.entry_row(new_entry)
+                summary.apply_entries(added=[new_row])
                 db.session.commit()
+                invalidation.entries_changed([new_row])
                 flash('Labour entry recorded successfully!', 'success')
             except Exception as e:
                 db.session.rollback()
@@ -271,11 +471,11 @@ def entry():
             return redirect(url_for('employee.entry'))        # PRG pattern
 
     # ------------------------ GET  ------------------------
-    today = date.today()
+    today = local_date()
     today_entries = (LabourEntry.query
                     .filter(
                         LabourEntry.site_id == employee.site_id,       # this site only
-                        func.date(LabourEntry.timestamp) == today      # today's rows
+                        LabourEntry.work_date == today                 # today's rows (site-local)
                     )
                     .order_by(LabourEntry.timestamp.desc())
                     .all())
@@ -284,10 +484,174 @@ def entry():
         'entry.html',
         employee=employee,
         activities=activities,
-        labours=active_labours,
-        labour_entries=today_entries          
+        labour_entries=today_entries,
+        client_key=uuid.uuid4().hex
     )
 
+@employee_bp.route('/entry/bulk', methods=['POST'])
+def bulk_entry():
+    """Record a whole crew's entries in one request and one transaction"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+        
+    if session.get('user_type') != 'employee':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+
+    employee = Employee.query.get_or_404(session['user_id'])
+    
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('entries')
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({'success': False, 'message': 'A non-empty list of entries is required'}), 400
+    if len(items) > MAX_BULK_ENTRIES:
+        return jsonify({'success': False, 'message': f'At most {MAX_BULK_ENTRIES} entries per request'}), 400
+    
+    rows, errors = prepare_entries(employee, items)
+    
+    try:
+        snapshots = insert_entries(rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(e)
+        return jsonify({'success': False, 'message': 'Error saving labour entries', 'errors': errors}), 500
+    
+    invalidation.entries_changed(snapshots)
+    
+    return jsonify({
+        'success': bool(rows),
+        'inserted': len(rows),
+        'rejected': len(errors),
+        'errors': errors
+    }), 200 if rows else 400
+
+@employee_bp.route('/entry/sync', methods=['POST'])
+def sync_entries():
+    """
+    Flush entries queued on a device while offline.
+    
+    Payload: {"entries": [{"client_key": ..., "recorded_at": ..., <entry fields>}]}
+    Every entry needs a unique client_key generated on the device; replaying
+    a batch returns the same server ids without inserting anything twice.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+        
+    if session.get('user_type') != 'employee':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+
+    employee = Employee.query.get_or_404(session['user_id'])
+    
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('entries')
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({'success': False, 'message': 'A non-empty list of entries is required'}), 400
+    if len(items) > MAX_SYNC_ENTRIES:
+        return jsonify({'success': False, 'message': f'At most {MAX_SYNC_ENTRIES} entries per request'}), 400
+    
+    # Validate the sync fields, then the entry fields shared with /entry/bulk
+    keys, recorded, key_errors, seen = [], [], {}, set()
+    for index, item in enumerate(items):
+        client_key = str(item.get('client_key') or '').strip()
+        if not client_key:
+            key_errors.setdefault(index, []).append('client_key is required.')
+        elif len(client_key) > MAX_CLIENT_KEY_LENGTH:
+            key_errors.setdefault(index, []).append(f'client_key must be at most {MAX_CLIENT_KEY_LENGTH} characters.')
+        elif client_key in seen:
+            key_errors.setdefault(index, []).append('client_key is repeated in this batch.')
+        seen.add(client_key)
+        keys.append(client_key)
+        
+        recorded_at = None
+        if item.get('recorded_at'):
+            try:
+                recorded_at = _parse_recorded_at(item['recorded_at'])
+            except (TypeError, ValueError):
+                key_errors.setdefault(index, []).append('recorded_at must be a past ISO 8601 timestamp.')
+        recorded.append(recorded_at)
+    
+    rows, entry_errors = prepare_entries(employee, items)
+    
+    rejected = {error['row']: error for error in entry_errors}
+    for index, messages in key_errors.items():
+        rejected.setdefault(index, {
+            'row': index, 'labour_id': items[index].get('labour_id'), 'errors': []
+        })['errors'][:0] = messages
+    
+    # prepare_entries() keeps the order of the items it accepts
+    entry_error_rows = {error['row'] for error in entry_errors}
+    valid_indexes = [index for index in range(len(items)) if index not in entry_error_rows]
+    candidates = []
+    for index, row in zip(valid_indexes, rows):
+        if index in rejected:
+            continue
+        row['client_key'] = keys[index]
+        if recorded[index]:
+            row['timestamp'] = recorded[index]
+            row['work_date'] = local_date(recorded[index])
+        candidates.append((index, row))
+    
+    # A backdated recorded_at must not reach a payroll month that is already closed
+    closed = payroll.closed_months(
+        (row['labour_id'], row['work_date'].year, row['work_date'].month) for _, row in candidates
+    )
+    accepted = []
+    for index, row in candidates:
+        if (row['labour_id'], row['work_date'].year, row['work_date'].month) in closed:
+            rejected[index] = {
+                'row': index, 'labour_id': items[index].get('labour_id'),
+                'errors': ['recorded_at falls in a closed payroll month.']
+            }
+        else:
+            accepted.append(row)
+    
+    try:
+        inserted, snapshots = upsert_entries(accepted)
+        # Keys skipped by ON CONFLICT were stored by an earlier attempt; only
+        # this employee's own entries count as replays
+        replayed = [row['client_key'] for row in accepted if row['client_key'] not in inserted]
+        existing = dict(
+            db.session.query(LabourEntry.client_key, LabourEntry.id).filter(
+                LabourEntry.client_key.in_(replayed),
+                LabourEntry.employee_id == employee.id,
+                LabourEntry.site_id == employee.site_id
+            ).all()
+        ) if replayed else {}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(e)
+        return jsonify({'success': False, 'message': 'Error syncing labour entries'}), 500
+    
+    invalidation.entries_changed(snapshots)
+    
+    results = []
+    for index, row in candidates:
+        client_key = row['client_key']
+        if index in rejected:
+            continue
+        if client_key in inserted:
+            results.append({'client_key': client_key, 'id': inserted[client_key], 'status': 'created'})
+        elif client_key in existing:
+            results.append({'client_key': client_key, 'id': existing[client_key], 'status': 'duplicate'})
+        else:
+            # Stored by someone else: reject without revealing that entry
+            rejected[index] = {
+                'row': index, 'labour_id': items[index].get('labour_id'),
+                'errors': ['client_key is already in use.']
+            }
+    
+    errors = [dict(rejected[index], client_key=keys[index] or None) for index in sorted(rejected)]
+    
+    return jsonify({
+        'success': not errors,
+        'created': len(inserted),
+        'duplicates': len(results) - len(inserted),
+        'rejected': len(errors),
+        'results': results,
+        'errors': errors
+    })
+
 @employee_bp.route('/entry/delete/<int:entry_id>', methods=['POST'])
 def delete_entry(entry_id):
     # Only employees can use this view
@@ -310,8 +674,11 @@ def delete_entry(entry_id):
         labour_name = entry.labour.name
         activity = entry.activity
         
+        deleted_row = summary.entry_row(entry)
+        summary.apply_entries(removed=[deleted_row])
         db.session.delete(entry)
         db.session.commit()
+        invalidation.entries_changed([deleted_row])
         
         return jsonify({
             'success': True, 
@@ -365,7 +732,7 @@ def get_employee(employee_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('employee_m'):
         return jsonify({'error': 'Permission denied'}), 403
     
@@ -379,7 +746,7 @@ def get_all_employees():
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('employee_m'):
         return jsonify({'error': 'Permission denied'}), 403
     
@@ -0,0 +1,483 @@
+"""
+Bulk CSV imports: historical labour entries and labourer onboarding.
+
+Used when onboarding a site with months of paper or Excel attendance. The
+CSV is streamed and validated in chunks; labour, site and employee codes
+are resolved in bulk per chunk, and valid rows are loaded with PostgreSQL
+COPY (multi-row INSERTs on other drivers) in a single transaction. Each
+chunk is added to the daily rollup with summary.apply_entries(), so other
+sites' rows are never rewritten.
+
+Expected columns (header row required, case-insensitive):
+    work_date, labour_id, site, employee, activity, status, unit,
+    rate_type, rate, total_hours, qty, amount
+
+`site` is a site id or exact site name, `employee` the username of the
+employee recorded as the author (optional when a default is given) and
+`work_date` is YYYY-MM-DD or DD/MM/YYYY. Rows that fail validation are
+written to a rejected-rows CSV together with their line number and errors.
+
+Labourer imports take the columns labour_id, name, password and optionally
+visa_cost and visa_paid. Passwords are hashed on a process pool across all
+cores and the whole batch is inserted in one transaction.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from datetime import datetime, timezone, time as time_of_day
+from zoneinfo import ZoneInfo
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.security import generate_password_hash
+
+import counters
+import invalidation
+import summary
+from employee import parse_entry_values, resolve_labour_codes
+from models import db, local_date, User, Site, Employee, Labour, LabourEntry
+
+CHUNK_SIZE = 5000
+INSERT_BATCH_SIZE = 1000
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+# labour_entries columns in the order they are written by COPY
+COPY_COLUMNS = (
+    'labour_id', 'employee_id', 'site_id', 'timestamp', 'work_date', 'activity', 'status',
+    'unit', 'rate_type', 'rate', 'total_hours', 'qty', 'amount'
+)
+
+
+@dataclass
+class ImportResult:
+    total: int
+    inserted: int
+    rejected: int
+    seconds: float
+    rejects_path: str = None
+
+    @property
+    def rows_per_second(self):
+        return self.total / self.seconds if self.seconds else float(self.total)
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1)
+        }
+
+
+def _normalize_header(name):
+    return (name or '').strip().lower().replace(' ', '_')
+
+
+def _parse_work_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime((value or '').strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _entry_timestamp(work_date, site_timezone):
+    """Historical rows have no time of day; store local noon so timestamp and work_date agree"""
+    local_noon = datetime.combine(work_date, time_of_day(12), tzinfo=site_timezone)
+    return local_noon.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class _SiteResolver:
+    """Resolve site ids and exact names from one query over the (small) sites table"""
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        for site_id, name in db.session.query(Site.id, Site.name).all():
+            self.by_id[str(site_id)] = site_id
+            # None marks a name shared by several sites
+            key = name.strip().lower()
+            self.by_name[key] = None if key in self.by_name else site_id
+
+    def resolve(self, value):
+        value = (value or '').strip()
+        if value in self.by_id:
+            return self.by_id[value], None
+        site_id = self.by_name.get(value.lower(), 0)
+        if site_id is None:
+            return None, 'Site name is ambiguous; use the site id.'
+        if not site_id:
+            return None, 'Site not found.'
+        return site_id, None
+
+
+def _resolve_employees(usernames, known):
+    """Add {username: id} for usernames not resolved yet, with one IN query"""
+    missing = {username for username in usernames if username and username not in known}
+    if missing:
+        known.update(db.session.query(Employee.username, Employee.id).filter(Employee.username.in_(missing)).all())
+    return known
+
+
+def _validate_chunk(chunk, sites, employees, default_employee, site_timezone, today):
+    """
+    Validate a chunk of (line_number, record) pairs.
+
+    Returns (rows, rejected): insertable labour_entries dicts and
+    (line_number, record, errors) tuples.
+    """
+    parsed = [(line, record, *parse_entry_values(record)) for line, record in chunk]
+    labours = resolve_labour_codes(values['labour_code'] for _, _, values, _ in parsed if values)
+    _resolve_employees(((record.get('employee') or '').strip() or default_employee for _, record, _, _ in parsed), employees)
+
+    rows, rejected = [], []
+    for line, record, values, errors in parsed:
+        work_date = _parse_work_date(record.get('work_date'))
+        if not work_date:
+            errors.append('work_date must be YYYY-MM-DD or DD/MM/YYYY.')
+        elif work_date > today:
+            errors.append('work_date is in the future.')
+
+        site_id, site_error = sites.resolve(record.get('site'))
+        if site_error:
+            errors.append(site_error)
+
+        username = (record.get('employee') or '').strip() or default_employee
+        employee_id = employees.get(username)
+        if not employee_id:
+            errors.append('Employee not found.' if username else 'Employee is required.')
+
+        labour = labours.get(values['labour_code']) if values else None
+        if values and values['labour_code'] and not labour:
+            errors.append('Labour ID not found.')
+
+        if errors:
+            rejected.append((line, record, errors))
+            continue
+
+        row = dict(values, labour_id=labour[0], employee_id=employee_id, site_id=site_id,
+                   timestamp=_entry_timestamp(work_date, site_timezone), work_date=work_date)
+        del row['labour_code']
+        rows.append(row)
+
+    return rows, rejected
+
+
+def _uses_copy():
+    return db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2'
+
+
+def _copy_rows(rows):
+    """Load rows with COPY ... FROM STDIN on the session's connection (same transaction)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # Empty unquoted CSV fields are read as NULL by COPY
+        writer.writerow(['' if row[column] is None else row[column] for column in COPY_COLUMNS])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {LabourEntry.__tablename__} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_rows(rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(LabourEntry.__table__.insert().values(rows[start:start + INSERT_BATCH_SIZE]))
+
+
+def import_entries(stream, rejects_path, default_employee=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Import labour entries from a CSV text stream.
+
+    Everything is loaded in one transaction, which is committed here; on
+    error nothing is imported. Each chunk's rows are applied to the rollup
+    as deltas, so only the imported (site, labourer, day) keys are touched. Rejected rows are
+    written to `rejects_path` (removed again if nothing was rejected).
+    `progress`, if given, is called with (rows_read, rows_loaded) after each
+    chunk.
+    """
+    started = time.perf_counter()
+    site_timezone = ZoneInfo(current_app.config['SITE_TIMEZONE'])
+    today = local_date()
+    load = _copy_rows if _uses_copy() else _insert_rows
+
+    reader = csv.reader(stream)
+    header = [_normalize_header(name) for name in next(reader, [])]
+    if 'work_date' not in header or 'labour_id' not in header:
+        raise ValueError('The CSV header must include at least work_date and labour_id.')
+
+    sites = _SiteResolver()
+    employees = {}
+    touched = set()
+    counts = {'total': 0, 'inserted': 0, 'rejected': 0}
+
+    with open(rejects_path, 'w', newline='', encoding='utf-8') as rejects_file:
+        rejects = csv.writer(rejects_file)
+        rejects.writerow(['line'] + header + ['errors'])
+
+        def flush(chunk):
+            rows, chunk_rejected = _validate_chunk(chunk, sites, employees, default_employee, site_timezone, today)
+            if rows:
+                load(rows)
+                summary.apply_entries(added=[summary.values_row(row) for row in rows])
+            touched.update((row['labour_id'], row['site_id'], row['work_date']) for row in rows)
+            for line, record, errors in chunk_rejected:
+                rejects.writerow([line] + [record.get(column, '') for column in header] + ['; '.join(errors)])
+
+            counts['total'] += len(chunk)
+            counts['inserted'] += len(rows)
+            counts['rejected'] += len(chunk_rejected)
+            if progress:
+                progress(counts['total'], counts['inserted'])
+
+        try:
+            chunk = []
+            # Line 1 is the header
+            for line, values in enumerate(reader, start=2):
+                if not any(values):
+                    continue
+                chunk.append((line, dict(zip(header, values))))
+                if len(chunk) >= chunk_size:
+                    flush(chunk)
+                    chunk = []
+            if chunk:
+                flush(chunk)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    invalidation.entries_changed(
+        {'labour_id': labour_id, 'site_id': site_id, 'work_date': work_date}
+        for labour_id, site_id, work_date in touched
+    )
+
+    if not counts['rejected']:
+        os.remove(rejects_path)
+        rejects_path = None
+
+    return ImportResult(
+        counts['total'], counts['inserted'], counts['rejected'], time.perf_counter() - started, rejects_path
+    )
+
+
+def _write_rejects(rejects_path, header, rejected):
+    """Write (line, record, errors) tuples to a CSV; returns None when there are none"""
+    if not rejected:
+        return None
+    with open(rejects_path, 'w', newline='', encoding='utf-8') as rejects_file:
+        writer = csv.writer(rejects_file)
+        writer.writerow(['line'] + header + ['errors'])
+        for line, record, errors in rejected:
+            writer.writerow([line] + [record.get(column, '') for column in header] + ['; '.join(errors)])
+    return rejects_path
+
+
+def _validate_labours(records):
+    """
+    Validate (line_number, record) labourer rows.
+
+    Existing labour IDs are looked up with one IN query. Returns (rows,
+    rejected) where rows still carry the plain password.
+    """
+    codes = {(record.get('labour_id') or '').strip() for _, record in records}
+    existing = {code for code, in db.session.query(Labour.labour_id).filter(Labour.labour_id.in_(codes - {''})).all()}
+
+    rows, rejected, seen = [], [], set()
+    for line, record in records:
+        errors = []
+        code = (record.get('labour_id') or '').strip()
+        name = (record.get('name') or '').strip()
+        password = record.get('password') or ''
+
+        if not code or not name:
+            errors.append('Labour name and ID are required.')
+        elif code in existing:
+            errors.append('A labour with this ID already exists.')
+        elif code in seen:
+            errors.append('Labour ID is repeated in this file.')
+        if not password:
+            errors.append('Password is required.')
+        try:
+            visa_cost = float(record.get('visa_cost') or 0)
+            visa_paid = float(record.get('visa_paid') or 0)
+        except ValueError:
+            errors.append('Visa cost and amount received must be numbers.')
+
+        seen.add(code)
+        if errors:
+            rejected.append((line, record, errors))
+            continue
+
+        rows.append({
+            'labour_id': code,
+            'name': name,
+            'password': password,
+            'visa_cost': visa_cost,
+            'visa_paid': visa_paid
+        })
+
+    return rows, rejected
+
+
+def hash_passwords(passwords, method, workers=None, progress=None):
+    """
+    Hash passwords with generate_password_hash(method=method) on a process pool.
+
+    The hash is deliberately slow and CPU bound, so worker processes (one
+    per core by default) are used instead of threads. They are started
+    with 'spawn': this also runs inside web workers whose thread pools
+    (password verification, exports) are live, and forking a process with
+    running threads can deadlock the child. `progress` is called with
+    (hashed, total) as results come in.
+    """
+    passwords = list(passwords)
+    hash_one = partial(generate_password_hash, method=method)
+    if len(passwords) <= 1:
+        return [hash_one(password) for password in passwords]
+
+    hashes = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        chunksize = max(1, len(passwords) // ((workers or os.cpu_count() or 1) * 4))
+        for password_hash in pool.map(hash_one, passwords, chunksize=chunksize):
+            hashes.append(password_hash)
+            if progress and (len(hashes) % 50 == 0 or len(hashes) == len(passwords)):
+                progress(len(hashes), len(passwords))
+    return hashes
+
+
+def import_labours(stream, created_by, rejects_path, workers=None, progress=None):
+    """
+    Create labourers from a CSV text stream in one transaction.
+
+    All rows are validated (duplicate IDs checked with one query) before
+    any password is hashed; the valid rows are then inserted with one
+    multi-row INSERT and committed here. Rejected rows are written to
+    `rejects_path`. `progress`, if given, is called with (hashed, total).
+    """
+    started = time.perf_counter()
+
+    reader = csv.reader(stream)
+    header = [_normalize_header(name) for name in next(reader, [])]
+    if not {'labour_id', 'name', 'password'} <= set(header):
+        raise ValueError('The CSV header must include labour_id, name and password.')
+
+    # Line 1 is the header
+    records = [(line, dict(zip(header, values))) for line, values in enumerate(reader, start=2) if any(values)]
+    rows, rejected = _validate_labours(records)
+
+    hashes = hash_passwords(
+        (row.pop('password') for row in rows),
+        current_app.config['PASSWORD_HASH_METHODS']['labour'],
+        workers or current_app.config['PASSWORD_HASH_WORKERS'],
+        progress
+    )
+    created_at = datetime.utcnow()
+    values = [
+        dict(row, password_hash=password_hash, is_active=True, created_by=created_by,
+             created_at=created_at, advance_payment=0.0)
+        for row, password_hash in zip(rows, hashes)
+    ]
+
+    try:
+        for start in range(0, len(values), INSERT_BATCH_SIZE):
+            db.session.execute(Labour.__table__.insert().values(values[start:start + INSERT_BATCH_SIZE]))
+        counters.adjust('labour', len(values))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return ImportResult(
+        len(records), len(values), len(rejected), time.perf_counter() - started,
+        _write_rejects(rejects_path, header, rejected)
+    )
+
+
+def import_dir():
+    directory = current_app.config['IMPORT_DIR']
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def new_rejects_path():
+    """Path for the rejected rows of an uploaded import, named by a random token"""
+    token = uuid.uuid4().hex
+    return token, os.path.join(import_dir(), f'{token}.rejected.csv')
+
+
+import_cli = AppGroup('import', help='Bulk data imports.')
+
+
+@import_cli.command('entries')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--employee', 'default_employee', help='Username recorded as author for rows without an employee column.')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows (default: <csv_path>.rejected.csv).')
+@click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='Rows validated and loaded per chunk.')
+def import_entries_command(csv_path, default_employee, rejects_path, chunk_size):
+    """Import historical labour entries from a CSV file."""
+    rejects_path = rejects_path or f'{csv_path}.rejected.csv'
+    started = time.perf_counter()
+
+    def progress(total, inserted):
+        elapsed = time.perf_counter() - started
+        click.echo(f'{total} rows read, {inserted} loaded ({total / elapsed if elapsed else total:,.0f} rows/s)...')
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as stream:
+        try:
+            result = import_entries(stream, rejects_path, default_employee, chunk_size, progress)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    click.echo(
+        f'Imported {result.inserted} of {result.total} rows in {result.seconds:.2f}s '
+        f'({result.rows_per_second:,.0f} rows/s); {result.rejected} rejected.'
+    )
+    if result.rejects_path:
+        click.echo(f'Rejected rows written to {result.rejects_path}')
+
+
+@import_cli.command('labours')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--created-by', 'created_by', required=True, help='Username of the admin recorded as creator.')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows (default: <csv_path>.rejected.csv).')
+@click.option('--workers', type=int, help='Password hashing processes (default: one per core).')
+def import_labours_command(csv_path, created_by, rejects_path, workers):
+    """Create labourers in bulk from a CSV file."""
+    user = User.query.filter_by(username=created_by).first()
+    if not user:
+        raise click.ClickException(f'User "{created_by}" not found.')
+
+    def progress(hashed, total):
+        click.echo(f'{hashed}/{total} passwords hashed...')
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as stream:
+        try:
+            result = import_labours(stream, user.id, rejects_path or f'{csv_path}.rejected.csv', workers, progress)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    click.echo(
+        f'Created {result.inserted} of {result.total} labourers in {result.seconds:.2f}s '
+        f'({result.rows_per_second:,.1f} rows/s); {result.rejected} rejected.'
+    )
+    if result.rejects_path:
+        click.echo(f'Rejected rows written to {result.rejects_path}')
@@ -0,0 +1,25 @@
+"""
+Cache invalidation hooks for labour entry writes.
+
+Call entries_changed() after committing any insert, update or delete of
+labour entries, passing summary.entry_row() snapshots of the affected
+rows (both the old and new snapshot for an edit). Bulk rewrites of the
+rollup and deletes of sites or labourers (whose rollup rows cascade) call
+everything_changed() instead.
+"""
+import payroll
+import report
+
+
+def entries_changed(rows):
+    """Invalidate every cached result derived from the given entries"""
+    rows = list(rows)
+    if rows:
+        report.invalidate_entries(rows)
+        payroll.invalidate_entries(rows)
+
+
+def everything_changed():
+    """Invalidate every cached report and wage card"""
+    report.invalidate_all()
+    payroll.invalidate_all()
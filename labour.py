@@ -1,8 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from models import db, User, Labour, LabourEntry
-from sqlalchemy import func
-from datetime import datetime
-from calendar import monthrange
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
+from models import db, Labour
+from sqlalchemy import func, case, or_
+from datetime import date
+import io
+import attendance
+import auth
+import counters
+import importers
+import invalidation
+import payroll
+import report
 
 # Create blueprint
 labour_bp = Blueprint('labour', __name__)
@@ -13,7 +20,7 @@ def labour_m():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('labour_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -63,6 +70,7 @@ def labour_m():
                 )
                 new_labour.set_password(password)
                 db.session.add(new_labour)
+                counters.adjust('labour', 1)
                 db.session.commit()
                 flash(f'Labour "{labour_name}" (ID: {labour_id}) has been added successfully.', 'success')
             
@@ -87,6 +95,7 @@ def labour_m():
                     labour.set_password(password)
                 
                 db.session.commit()
+                report.invalidate_all()  # labour performance shows the name and code
                 flash(f'Labour "{labour_name}" has been updated successfully.', 'success')
             
             else:
@@ -114,117 +123,15 @@ def wage_card():
         flash('Labour account not found or inactive.', 'danger')
         return redirect(url_for('logout'))
 
-    # Get selected month from query parameter or default to current month
-    selected_month = request.args.get('month')
-    if selected_month:
-        try:
-            selected_date = datetime.strptime(selected_month, '%Y-%m')
-        except ValueError:
-            selected_date = datetime.now()
-    else:
-        selected_date = datetime.now()
-
-    # Calculate attendance for the selected month
-    year = selected_date.year
-    month = selected_date.month
-    
-    # Get first and last day of the month
-    _, days_in_month = monthrange(year, month)
-    
-    # Query labour entries for this labour in the selected month
-    month_entries = LabourEntry.query.filter(
-        LabourEntry.labour_id == labour.id,
-        func.extract('year', LabourEntry.timestamp) == year,
-        func.extract('month', LabourEntry.timestamp) == month
-    ).all()
-
-    # Calculate total money from work entries (sum of all entries)
-    total_work_amount = sum(entry.amount or 0 for entry in month_entries)
-
-    # Group entries by date and status for attendance calculation
-    daily_status = {}  # {day: status}
-    
-    for entry in month_entries:
-        day = entry.timestamp.day
-        
-        # If we already have an entry for this day, prioritize 'present' over 'absent'
-        if day in daily_status:
-            if entry.status.lower() == 'present' or daily_status[day].lower() == 'present':
-                daily_status[day] = 'present'
-            # If both are absent, keep it as absent
-        else:
-            daily_status[day] = entry.status.lower()
-    
-    # Count present and absent days based on unique days
-    present_days_count = sum(1 for status in daily_status.values() if status == 'present')
-    explicitly_absent_days = sum(1 for status in daily_status.values() if status == 'absent')
-    
-    # For current month, only count up to today's date
-    # For past months, count all days in the month
-    # For future months, count no days as they haven't occurred yet
-    today = datetime.now().date()
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    
-    if year == current_year and month == current_month:
-        # Current month - only count up to today
-        max_day_to_count = min(today.day, days_in_month)
-    elif year < current_year or (year == current_year and month < current_month):
-        # Past month - count all days
-        max_day_to_count = days_in_month
-    else:
-        # Future month - count no days
-        max_day_to_count = 0
-    
-    # Calculate attendance
-    present_days = present_days_count
-    # Days without any entries (neither present nor absent)
-    days_without_entries = max_day_to_count - len(daily_status)
-    # Total absent days = explicitly marked absent + days with no entries
-    absent_days = days_without_entries + explicitly_absent_days
-    total_countable_days = max_day_to_count
-    
-    # Calculate penalty for excessive absences
-    PENALTY_PER_DAY = 25.0  # AED per day
-    ALLOWED_ABSENT_DAYS = 2  # Free absent days per month
-    INSURANCE_AMOUNT = 30.0  # AED per month (fixed deduction)
-    
-    penalty_days = max(0, absent_days - ALLOWED_ABSENT_DAYS)
-    total_penalty = penalty_days * PENALTY_PER_DAY
-    
-    # Calculate final payable amount after penalty, insurance, and advance
-    advance_amount = labour.advance_payment or 0.0  # Handle None case
-    total_money_payable = total_work_amount - total_penalty - INSURANCE_AMOUNT - advance_amount
-    
-    # Calculate attendance stats
-    attendance_stats = {
-        'month_year': selected_date.strftime('%B %Y'),
-        'days_in_month': days_in_month,
-        'total_countable_days': total_countable_days,
-        'present_days': present_days,
-        'absent_days': absent_days,
-        'days_with_entries': len(daily_status),  # Unique days with entries
-        'total_entries': len(month_entries),     # Total number of entries
-        'explicitly_absent': explicitly_absent_days,
-        'days_without_entries': days_without_entries,
-        'present_percentage': round((present_days / total_countable_days) * 100, 1) if total_countable_days > 0 else 0,
-        'absent_percentage': round((absent_days / total_countable_days) * 100, 1) if total_countable_days > 0 else 0,
-        'is_current_month': year == current_year and month == current_month,
-        'is_future_month': year > current_year or (year == current_year and month > current_month),
-        # Penalty-related stats
-        'penalty_days': penalty_days,
-        'total_penalty': total_penalty,
-        'penalty_per_day': PENALTY_PER_DAY,
-        'allowed_absent_days': ALLOWED_ABSENT_DAYS,
-        'total_work_amount': total_work_amount,
-        'insurance_amount': INSURANCE_AMOUNT
-    }
+    # Compute the selected month (default: current month)
+    year, month = payroll.parse_month(request.args.get('month'))
+    month_payroll = payroll.get_month_cached(labour, year, month)
 
     return render_template("wage_card.html", 
                 labour=labour, 
-                attendance_stats=attendance_stats,
-                selected_month=selected_date.strftime('%Y-%m'),
-                total_money_payable=total_money_payable)
+                attendance_stats=month_payroll.attendance_stats(),
+                selected_month=f'{year:04d}-{month:02d}',
+                total_money_payable=month_payroll.total_money_payable)
 
 @labour_bp.route('/labour/<int:labour_id>', methods=['GET', 'POST'])
 def labour_detail(labour_id):
@@ -232,119 +139,13 @@ def labour_detail(labour_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('labour_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
     
     labour = Labour.query.get_or_404(labour_id)
 
-    # Get selected month from query parameter or default to current month
-    selected_month = request.args.get('month')
-    if selected_month:
-        try:
-            selected_date = datetime.strptime(selected_month, '%Y-%m')
-        except ValueError:
-            selected_date = datetime.now()
-    else:
-        selected_date = datetime.now()
-
-    # Calculate attendance for the selected month
-    year = selected_date.year
-    month = selected_date.month
-    
-    # Get first and last day of the month
-    _, days_in_month = monthrange(year, month)
-    
-    # Query labour entries for this labour in the selected month
-    month_entries = LabourEntry.query.filter(
-        LabourEntry.labour_id == labour_id,
-        func.extract('year', LabourEntry.timestamp) == year,
-        func.extract('month', LabourEntry.timestamp) == month
-    ).all()
-
-    # Calculate total money from work entries (sum of all entries)
-    total_work_amount = sum(entry.amount or 0 for entry in month_entries)
-
-    # Group entries by date and status for attendance calculation
-    daily_status = {}  # {day: status}
-    
-    for entry in month_entries:
-        day = entry.timestamp.day
-        
-        # If we already have an entry for this day, prioritize 'present' over 'absent'
-        if day in daily_status:
-            if entry.status.lower() == 'present' or daily_status[day].lower() == 'present':
-                daily_status[day] = 'present'
-            # If both are absent, keep it as absent
-        else:
-            daily_status[day] = entry.status.lower()
-    
-    # Count present and absent days based on unique days
-    present_days_count = sum(1 for status in daily_status.values() if status == 'present')
-    explicitly_absent_days = sum(1 for status in daily_status.values() if status == 'absent')
-    
-    # For current month, only count up to today's date
-    # For past months, count all days in the month
-    # For future months, count no days as they haven't occurred yet
-    today = datetime.now().date()
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    
-    if year == current_year and month == current_month:
-        # Current month - only count up to today
-        max_day_to_count = min(today.day, days_in_month)
-    elif year < current_year or (year == current_year and month < current_month):
-        # Past month - count all days
-        max_day_to_count = days_in_month
-    else:
-        # Future month - count no days
-        max_day_to_count = 0
-    
-    # Calculate attendance
-    present_days = present_days_count
-    # Days without any entries (neither present nor absent)
-    days_without_entries = max_day_to_count - len(daily_status)
-    # Total absent days = explicitly marked absent + days with no entries
-    absent_days = days_without_entries + explicitly_absent_days
-    total_countable_days = max_day_to_count
-    
-    # Calculate penalty for excessive absences
-    PENALTY_PER_DAY = 25.0  # AED per day
-    ALLOWED_ABSENT_DAYS = 2  # Free absent days per month
-    INSURANCE_AMOUNT = 30.0  # AED per month (fixed deduction)
-    
-    penalty_days = max(0, absent_days - ALLOWED_ABSENT_DAYS)
-    total_penalty = penalty_days * PENALTY_PER_DAY
-    
-    # Calculate final payable amount after penalty, insurance, and advance
-    advance_amount = labour.advance_payment or 0.0  # Handle None case
-    total_money_payable = total_work_amount - total_penalty - INSURANCE_AMOUNT - advance_amount
-    
-    # Calculate attendance stats
-    attendance_stats = {
-        'month_year': selected_date.strftime('%B %Y'),
-        'days_in_month': days_in_month,
-        'total_countable_days': total_countable_days,
-        'present_days': present_days,
-        'absent_days': absent_days,
-        'days_with_entries': len(daily_status),  # Unique days with entries
-        'total_entries': len(month_entries),     # Total number of entries
-        'explicitly_absent': explicitly_absent_days,
-        'days_without_entries': days_without_entries,
-        'present_percentage': round((present_days / total_countable_days) * 100, 1) if total_countable_days > 0 else 0,
-        'absent_percentage': round((absent_days / total_countable_days) * 100, 1) if total_countable_days > 0 else 0,
-        'is_current_month': year == current_year and month == current_month,
-        'is_future_month': year > current_year or (year == current_year and month > current_month),
-        # Penalty-related stats
-        'penalty_days': penalty_days,
-        'total_penalty': total_penalty,
-        'penalty_per_day': PENALTY_PER_DAY,
-        'allowed_absent_days': ALLOWED_ABSENT_DAYS,
-        'total_work_amount': total_work_amount,
-        'insurance_amount': INSURANCE_AMOUNT
-    }
-
     if request.method == 'POST':
         # Handle visa payment update
         if 'additional_payment' in request.form:
@@ -374,26 +175,67 @@ def labour_detail(labour_id):
 
                 labour.advance_payment += advance_amount
                 db.session.commit()
+                payroll.invalidate_labour(labour.id)
                 flash(f"Advance payment of {advance_amount} AED added successfully", "success")
             except Exception as e:
                 db.session.rollback()
                 flash("Error updating advance payment", "danger")
                 print("Advance payment error:", e)
 
+    # Compute the selected month (default: current month) after any advance update
+    year, month = payroll.parse_month(request.args.get('month'))
+    month_payroll = payroll.get_month_cached(labour, year, month)
+
     return render_template("labour_detail.html", 
         labour=labour, 
-        attendance_stats=attendance_stats,
-        selected_month=selected_date.strftime('%Y-%m'),
-        total_money_payable=total_money_payable)
+        attendance_stats=month_payroll.attendance_stats(),
+        selected_month=f'{year:04d}-{month:02d}',
+        total_money_payable=month_payroll.total_money_payable)
 
 
+@labour_bp.route('/labour_m/import', methods=['POST'])
+def import_labours():
+    """Create a crew of labourers from an uploaded CSV (labour_id, name, password[, visa_cost, visa_paid])"""
+    # Check permission
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        flash('You do not have permission to access this page.', 'danger')
+        return redirect(url_for('admin.admin_dashboard'))
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV file to import.', 'error')
+        return redirect(url_for('labour.labour_m'))
+    
+    token, rejects_path = importers.new_rejects_path()
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    
+    try:
+        result = importers.import_labours(stream, user.id, rejects_path)
+    except (ValueError, UnicodeDecodeError) as e:
+        flash(f'Import failed: {e}', 'error')
+        return redirect(url_for('labour.labour_m'))
+    except Exception as e:
+        current_app.logger.exception(e)
+        flash('An error occurred while importing labourers; nothing was imported.', 'error')
+        return redirect(url_for('labour.labour_m'))
+    
+    flash(f'{result.inserted} of {result.total} labourers imported in {result.seconds:.1f}s.', 'success')
+    if result.rejects_path:
+        flash(f'{result.rejected} rows were rejected. Download them from '
+              f'{url_for("admin.download_import_rejects", token=token)}', 'error')
+    return redirect(url_for('labour.labour_m'))
+
 @labour_bp.route('/labour_m/delete', methods=['POST'])
 def delete_labour():
     # Check permission
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('labour_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -410,7 +252,9 @@ def delete_labour():
         labour_id = labour.labour_id
         
         db.session.delete(labour)
+        counters.adjust('labour', -1)
         db.session.commit()
+        invalidation.everything_changed()
         
         flash(f'Labour "{labour_name}" (ID: {labour_id}) has been deleted successfully.', 'success')
         
@@ -427,7 +271,7 @@ def toggle_labour_status():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'})
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('labour_m'):
         return jsonify({'success': False, 'message': 'Permission denied'})
     
@@ -459,7 +303,7 @@ def get_labour(labour_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('labour_m'):
         return jsonify({'error': 'Permission denied'}), 403
     
@@ -473,13 +317,157 @@ def get_all_labour():
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('labour_m'):
         return jsonify({'error': 'Permission denied'}), 403
     
     labour_records = Labour.query.order_by(Labour.created_at.desc()).all()
     return jsonify([labour.to_dict() for labour in labour_records])
 
+MAX_RANGE_MONTHS = 36
+
+def _month_range_from_request():
+    """Parse the from/to (YYYY-MM) range of a calendar request, defaulting to the last 12 months"""
+    year_to, month_to = payroll.parse_month(request.args.get('to'))
+    month_to = date(year_to, month_to, 1)
+    
+    default_index = year_to * 12 + month_to.month - 1 - 11
+    default_from = date(default_index // 12, default_index % 12 + 1, 1)
+    year_from, month_from = payroll.parse_month(request.args.get('from'), default=default_from)
+    month_from = date(year_from, month_from, 1)
+    
+    if month_from > month_to:
+        return None, None
+    if (month_to.year - month_from.year) * 12 + month_to.month - month_from.month >= MAX_RANGE_MONTHS:
+        return None, None
+    return month_from, month_to
+
+def _labour_access_error(labour_id):
+    """Labourers may view their own data; admins need labour management access"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    if session.get('user_type') == 'labour':
+        if session['user_id'] != labour_id:
+            return jsonify({'error': 'Permission denied'}), 403
+    else:
+        user = auth.current_user()
+        if not user or not user.has_permission('labour_m'):
+            return jsonify({'error': 'Permission denied'}), 403
+    
+    return None
+
+def _wage_history(labour, month_from, month_to):
+    """Build the wage history payload shared by the API and the history pages"""
+    # Year to date always starts in January, even when the requested range starts later
+    year_start = date(month_to.year, 1, 1)
+    computed = payroll.compute_history(labour, min(month_from, year_start), month_to)
+    history = [item for item in computed if (item.year, item.month) >= (month_from.year, month_from.month)]
+    
+    return {
+        'labour_id': labour.id,
+        'from': month_from.strftime('%Y-%m'),
+        'to': month_to.strftime('%Y-%m'),
+        'months': [item.to_dict() for item in history],
+        'totals': payroll.summarize_history(history),
+        'year_to_date': payroll.summarize_history([item for item in computed if item.year == month_to.year])
+    }
+
+@labour_bp.route('/api/labour/<int:labour_id>/attendance-calendar')
+def labour_attendance_calendar(labour_id):
+    """Day-by-day attendance heatmap of a labourer over a range of months"""
+    access_error = _labour_access_error(labour_id)
+    if access_error:
+        return access_error
+    
+    month_from, month_to = _month_range_from_request()
+    if month_from is None:
+        return jsonify({'error': f'Invalid month range (at most {MAX_RANGE_MONTHS} months)'}), 400
+    
+    return jsonify({
+        'labour_id': labour_id,
+        'months': attendance.labour_calendar(labour_id, month_from, month_to)
+    })
+
+@labour_bp.route('/api/site/<int:site_id>/attendance-calendar')
+def site_attendance_calendar(site_id):
+    """Daily present/absent labourer counts of a site over a range of months"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user = auth.current_user()
+    if not user or not (user.has_permission('labour_m') or user.has_permission('site_m')):
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    month_from, month_to = _month_range_from_request()
+    if month_from is None:
+        return jsonify({'error': f'Invalid month range (at most {MAX_RANGE_MONTHS} months)'}), 400
+    
+    return jsonify({
+        'site_id': site_id,
+        'months': attendance.site_calendar(site_id, month_from, month_to)
+    })
+
+@labour_bp.route('/api/labour/<int:labour_id>/wage-history')
+def labour_wage_history_api(labour_id):
+    """Earnings, attendance and deductions of a labourer for a range of months"""
+    access_error = _labour_access_error(labour_id)
+    if access_error:
+        return access_error
+    
+    labour = Labour.query.get_or_404(labour_id)
+    
+    month_from, month_to = _month_range_from_request()
+    if month_from is None:
+        return jsonify({'error': f'Invalid month range (at most {MAX_RANGE_MONTHS} months)'}), 400
+    
+    return jsonify(_wage_history(labour, month_from, month_to))
+
+@labour_bp.route('/labour/<int:labour_id>/wage-history')
+def labour_wage_history(labour_id):
+    # Check permission
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    user = auth.current_user()
+    if not user or not user.has_permission('labour_m'):
+        flash('You do not have permission to access this page.', 'danger')
+        return redirect(url_for('admin.admin_dashboard'))
+    
+    labour = Labour.query.get_or_404(labour_id)
+    
+    month_from, month_to = _month_range_from_request()
+    if month_from is None:
+        flash(f'Please select a range of at most {MAX_RANGE_MONTHS} months.', 'danger')
+        return redirect(url_for('labour.labour_wage_history', labour_id=labour_id))
+    
+    return render_template("wage_history.html",
+        labour=labour,
+        history=_wage_history(labour, month_from, month_to),
+        back_url=url_for('labour.labour_detail', labour_id=labour_id))
+
+@labour_bp.route('/wage_card/history')
+def wage_card_history():
+    """Wage history page for labour users"""
+    # Check if labour is logged in
+    if 'user_id' not in session or session.get('user_type') != 'labour':
+        return redirect(url_for('login'))
+    
+    labour = Labour.query.get(session['user_id'])
+    if not labour or not labour.is_active:
+        flash('Labour account not found or inactive.', 'danger')
+        return redirect(url_for('logout'))
+    
+    month_from, month_to = _month_range_from_request()
+    if month_from is None:
+        flash(f'Please select a range of at most {MAX_RANGE_MONTHS} months.', 'danger')
+        return redirect(url_for('labour.wage_card_history'))
+    
+    return render_template("wage_history.html",
+        labour=labour,
+        history=_wage_history(labour, month_from, month_to),
+        back_url=url_for('labour.wage_card'))
+
 @labour_bp.route('/api/labours', methods=['GET'])
 def api_get_labours_for_employee():
     if 'user_id' not in session:
@@ -490,4 +478,44 @@ def api_get_labours_for_employee():
 
     # Only return active labours
     labours = Labour.query.filter_by(is_active=True).all()
-    return jsonify([labour.to_dict() for labour in labours])
\ No newline at end of file
+    return jsonify([labour.to_dict() for labour in labours])
+
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+def search_labours(term, limit=SEARCH_LIMIT):
+    """
+    Active labourers whose ID or name starts with `term` (case-insensitive).
+    
+    Matches on lower(column) LIKE 'term%' so the text_pattern_ops indexes
+    on labour.labour_id and labour.name are used. Exact ID matches come
+    first, then ID prefixes, then name prefixes.
+    """
+    term = term.strip().lower()
+    if not term:
+        return []
+    pattern = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    lower_code = func.lower(Labour.labour_id)
+    lower_name = func.lower(Labour.name)
+    
+    rank = case((lower_code == term, 0), (lower_code.like(pattern), 1), else_=2)
+    return db.session.query(Labour.id, Labour.labour_id, Labour.name).filter(
+        Labour.is_active == True,
+        or_(lower_code.like(pattern), lower_name.like(pattern))
+    ).order_by(rank, Labour.labour_id).limit(limit).all()
+
+@labour_bp.route('/api/labours/search', methods=['GET'])
+def api_search_labours():
+    """Typeahead for the entry page: top matches for ?q= (limit with ?limit=)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    if session.get('user_type') != 'employee':
+        return jsonify({'error': 'Access denied'}), 403
+
+    limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), MAX_SEARCH_LIMIT)
+    matches = search_labours(request.args.get('q', ''), limit)
+    return jsonify([
+        {'id': labour_db_id, 'labour_id': code, 'name': name}
+        for labour_db_id, code, name in matches
+    ])
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""add labour_entries.work_date
+
+Revision ID: 3f9a2c4d8e17
+Revises: 
+Create Date: 2026-10-17 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c4d8e17'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Added nullable, backfilled, then made NOT NULL
+    op.add_column('labour_entries', sa.Column('work_date', sa.Date(), nullable=True))
+
+    # Site-local date of the naive UTC timestamp, as models.local_date() computes for new rows
+    op.execute(sa.text(
+        "UPDATE labour_entries "
+        "SET work_date = COALESCE(CAST(timezone(:site_timezone, timezone('UTC', timestamp)) AS date), CURRENT_DATE) "
+        "WHERE work_date IS NULL"
+    ).bindparams(site_timezone=current_app.config['SITE_TIMEZONE']))
+
+    op.alter_column('labour_entries', 'work_date', existing_type=sa.Date(), nullable=False)
+    op.create_index('ix_labour_entries_site_work_date', 'labour_entries', ['site_id', 'work_date'])
+    op.create_index('ix_labour_entries_labour_work_date', 'labour_entries', ['labour_id', 'work_date'])
+
+
+def downgrade():
+    op.drop_index('ix_labour_entries_labour_work_date', table_name='labour_entries')
+    op.drop_index('ix_labour_entries_site_work_date', table_name='labour_entries')
+    op.drop_column('labour_entries', 'work_date')
@@ -0,0 +1,27 @@
+"""add labour_entries.client_key
+
+Revision ID: 8b41d07e5c22
+Revises: 3f9a2c4d8e17
+Create Date: 2026-10-17 09:31:05.442871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d07e5c22'
+down_revision = '3f9a2c4d8e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing entries have no key; NULLs never conflict in the unique constraint
+    op.add_column('labour_entries', sa.Column('client_key', sa.String(length=64), nullable=True))
+    op.create_unique_constraint('labour_entries_client_key_key', 'labour_entries', ['client_key'])
+
+
+def downgrade():
+    op.drop_constraint('labour_entries_client_key_key', 'labour_entries', type_='unique')
+    op.drop_column('labour_entries', 'client_key')
@@ -0,0 +1,26 @@
+"""add users.permissions_version
+
+Revision ID: c5e872a1f390
+Revises: 8b41d07e5c22
+Create Date: 2026-10-17 09:44:52.907316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e872a1f390'
+down_revision = '8b41d07e5c22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The server default fills existing admins; new rows get the model's default
+    op.add_column('users', sa.Column('permissions_version', sa.Integer(), nullable=False, server_default='0'))
+    op.alter_column('users', 'permissions_version', existing_type=sa.Integer(), server_default=None)
+
+
+def downgrade():
+    op.drop_column('users', 'permissions_version')
@@ -1,10 +1,25 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 from sqlalchemy.orm import relationship
 
 db = SQLAlchemy()
 
+def local_date(value=None):
+    """Site-local calendar date (SITE_TIMEZONE) of a naive UTC datetime, default now"""
+    value = value or datetime.utcnow()
+    site_timezone = ZoneInfo(current_app.config['SITE_TIMEZONE'])
+    return value.replace(tzinfo=timezone.utc).astimezone(site_timezone).date()
+
+def _entry_work_date(context):
+    return local_date(context.get_current_parameters().get('timestamp'))
+
+def hash_password(password, user_type):
+    """Hash a password with the method configured for a principal type (PASSWORD_HASH_METHODS)"""
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHODS'][user_type])
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -19,9 +34,10 @@ class User(db.Model):
     can_access_employee_m = db.Column(db.Boolean, default=False)
     can_access_labour_m = db.Column(db.Boolean, default=False)
     can_access_admin_m = db.Column(db.Boolean, default=False)
+    permissions_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped by set_permissions
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password, 'admin')
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -46,6 +62,7 @@ class User(db.Model):
         self.can_access_employee_m = 'employee_m' in permissions
         self.can_access_labour_m = 'labour_m' in permissions
         self.can_access_admin_m = 'admin_m' in permissions
+        self.permissions_version = (self.permissions_version or 0) + 1
 
 
 class Site(db.Model):
@@ -96,9 +113,17 @@ class Labour(db.Model):
 
     creator = relationship('User', backref=db.backref('labour_records', lazy=True))
 
+    __table_args__ = (
+        # Prefix search for the entry page typeahead: lower(column) LIKE 'term%'
+        db.Index('ix_labour_lower_labour_id', db.func.lower(labour_id).label('lower_labour_id'),
+                 postgresql_ops={'lower_labour_id': 'text_pattern_ops'}),
+        db.Index('ix_labour_lower_name', db.func.lower(name).label('lower_name'),
+                 postgresql_ops={'lower_name': 'text_pattern_ops'}),
+    )
+
     def set_password(self, password):
         """Set password for labour"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password, 'labour')
 
     def check_password(self, password):
         """Check password for labour"""
@@ -165,7 +190,7 @@ class Employee(db.Model):
     creator = db.relationship('User', backref=db.backref('created_employees', lazy=True))
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password, 'employee')
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -194,6 +219,7 @@ class LabourEntry(db.Model):
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
     site_id = db.Column(db.Integer, db.ForeignKey('sites.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    work_date = db.Column(db.Date, nullable=False, default=_entry_work_date)  # Site-local date of timestamp
 
     labour = db.relationship('Labour', backref='entries')
     employee = db.relationship('Employee', backref='entries')
@@ -207,7 +233,168 @@ class LabourEntry(db.Model):
     qty = db.Column(db.Float, nullable=True)
     amount = db.Column(db.Float, nullable=True)
     rate_type = db.Column(db.String(20), nullable=False)  # 'Unit' or 'Hour'
+    client_key = db.Column(db.String(64), unique=True, nullable=True)  # Idempotency key from the submitting device
+
+    __table_args__ = (
+        db.Index('ix_labour_entries_site_work_date', 'site_id', 'work_date'),
+        db.Index('ix_labour_entries_labour_work_date', 'labour_id', 'work_date'),
+    )
+
+    def __repr__(self):
+            return f'<LabourEntry Labour:{self.labour_id} by Employee:{self.employee_id}>'
+
+
+class LabourDailySummary(db.Model):
+    """Daily rollup of labour entries, maintained on every entry write"""
+    __tablename__ = 'labour_daily_summary'
+
+    work_date = db.Column(db.Date, primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('sites.id', ondelete='CASCADE'), primary_key=True)
+    labour_id = db.Column(db.Integer, db.ForeignKey('labour.id', ondelete='CASCADE'), primary_key=True)
+    activity = db.Column(db.String(100), primary_key=True)
+
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+    present_count = db.Column(db.Integer, nullable=False, default=0)   # Entries marked Present
+    absent_count = db.Column(db.Integer, nullable=False, default=0)    # Entries marked Absent
+    total_hours = db.Column(db.Float, nullable=False, default=0.0)
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_labour_daily_summary_labour_date', 'labour_id', 'work_date'),
+    )
+
+    def __repr__(self):
+        return f'<LabourDailySummary {self.work_date} Site:{self.site_id} Labour:{self.labour_id}>'
+
+
+class PayrollRun(db.Model):
+    """One month-end payroll run over all active labourers"""
+    __tablename__ = 'payroll_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    duration_seconds = db.Column(db.Float, nullable=True)
+    labour_count = db.Column(db.Integer, nullable=False, default=0)
+    total_payable = db.Column(db.Float, nullable=False, default=0.0)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # None when run from the CLI
+
+    lines = db.relationship('PayrollLine', backref='run', lazy=True, cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<PayrollRun {self.year}-{self.month:02d} #{self.id}>'
+
+    def to_dict(self):
+        """Convert payroll run object to dictionary"""
+        return {
+            'id': self.id,
+            'year': self.year,
+            'month': self.month,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'duration_seconds': self.duration_seconds,
+            'labour_count': self.labour_count,
+            'total_payable': self.total_payable,
+            'created_by': self.created_by
+        }
+
+
+class PayrollLine(db.Model):
+    """A labourer's computed pay within a payroll run"""
+    __tablename__ = 'payroll_lines'
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('payroll_runs.id', ondelete='CASCADE'), nullable=False, index=True)
+    labour_id = db.Column(db.Integer, db.ForeignKey('labour.id', ondelete='CASCADE'), nullable=False)
+
+    present_days = db.Column(db.Integer, nullable=False)
+    absent_days = db.Column(db.Integer, nullable=False)
+    total_entries = db.Column(db.Integer, nullable=False)
+    penalty_days = db.Column(db.Integer, nullable=False)
+    total_penalty = db.Column(db.Float, nullable=False)
+    insurance_amount = db.Column(db.Float, nullable=False)
+    advance_amount = db.Column(db.Float, nullable=False)
+    total_work_amount = db.Column(db.Float, nullable=False)
+    total_money_payable = db.Column(db.Float, nullable=False)
+
+    labour = db.relationship('Labour')
+
+    def to_dict(self):
+        """Convert payroll line object to dictionary"""
+        return {
+            'labour_id': self.labour_id,
+            'present_days': self.present_days,
+            'absent_days': self.absent_days,
+            'total_entries': self.total_entries,
+            'penalty_days': self.penalty_days,
+            'total_penalty': self.total_penalty,
+            'insurance_amount': self.insurance_amount,
+            'advance_amount': self.advance_amount,
+            'total_work_amount': self.total_work_amount,
+            'total_money_payable': self.total_money_payable
+        }
+
+
+class PayrollSnapshot(db.Model):
+    """Immutable payroll of a labourer for a closed month"""
+    __tablename__ = 'payroll_snapshots'
+
+    labour_id = db.Column(db.Integer, db.ForeignKey('labour.id', ondelete='CASCADE'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+
+    days_in_month = db.Column(db.Integer, nullable=False)
+    total_countable_days = db.Column(db.Integer, nullable=False)
+    present_days = db.Column(db.Integer, nullable=False)
+    absent_days = db.Column(db.Integer, nullable=False)
+    days_with_entries = db.Column(db.Integer, nullable=False)
+    total_entries = db.Column(db.Integer, nullable=False)
+    explicitly_absent = db.Column(db.Integer, nullable=False)
+    days_without_entries = db.Column(db.Integer, nullable=False)
+    is_current_month = db.Column(db.Boolean, nullable=False, default=False)
+    is_future_month = db.Column(db.Boolean, nullable=False, default=False)
+    penalty_days = db.Column(db.Integer, nullable=False)
+    total_penalty = db.Column(db.Float, nullable=False)
+    penalty_per_day = db.Column(db.Float, nullable=False)
+    allowed_absent_days = db.Column(db.Integer, nullable=False)
+    total_work_amount = db.Column(db.Float, nullable=False)
+    insurance_amount = db.Column(db.Float, nullable=False)
+    advance_amount = db.Column(db.Float, nullable=False)
+    total_money_payable = db.Column(db.Float, nullable=False)
+
+    closed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # None when closed from the CLI
+
+    def __repr__(self):
+        return f'<PayrollSnapshot Labour:{self.labour_id} {self.year}-{self.month:02d}>'
+
+
+class LabourAttendanceMonth(db.Model):
+    """Attendance bitmaps of a labourer at a site for one month (bit day-1 per day)"""
+    __tablename__ = 'labour_attendance_months'
+
+    labour_id = db.Column(db.Integer, db.ForeignKey('labour.id', ondelete='CASCADE'), primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('sites.id', ondelete='CASCADE'), primary_key=True)
+    month_start = db.Column(db.Date, primary_key=True)
+
+    present_mask = db.Column(db.Integer, nullable=False, default=0)   # Days with a Present entry
+    absent_mask = db.Column(db.Integer, nullable=False, default=0)    # Days with entries but none Present
+
+    __table_args__ = (
+        db.Index('ix_labour_attendance_months_site_month', 'site_id', 'month_start'),
+    )
+
+    def __repr__(self):
+        return f'<LabourAttendanceMonth Labour:{self.labour_id} Site:{self.site_id} {self.month_start}>'
+
+
+class DashboardCounter(db.Model):
+    """Running totals for the admin dashboard, adjusted in the same transaction as the rows they count"""
+    __tablename__ = 'dashboard_counters'
 
+    name = db.Column(db.String(64), primary_key=True)   # e.g. 'labour', 'present:2025-06-01'
+    value = db.Column(db.BigInteger, nullable=False, default=0)
 
     def __repr__(self):
-            return f'<LabourEntry Labour:{self.labour_id} by Employee:{self.employee_id}>'
\ No newline at end of file
+        return f'<DashboardCounter {self.name}={self.value}>'
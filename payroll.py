@@ -0,0 +1,533 @@
+"""
+Monthly payroll calculation for labourers.
+
+Shared by the wage card, the labour detail page and batch jobs. A month is
+always read with a half-open [month_start, next_month_start) range over the
+daily summary rollup, so the lookup is an index range scan.
+"""
+import time
+from calendar import monthrange
+from dataclasses import dataclass, asdict, fields
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, case, cast, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import attendance
+import summary
+from cache import get_cache, versions
+from models import db, local_date, Labour, LabourDailySummary, PayrollRun, PayrollLine, PayrollSnapshot
+
+PENALTY_PER_DAY = 25.0      # AED per excess absent day
+ALLOWED_ABSENT_DAYS = 2     # Free absent days per month
+INSURANCE_AMOUNT = 30.0     # AED per month (fixed deduction)
+
+
+def month_bounds(year, month):
+    """Return (month_start, next_month_start) for a half-open month range"""
+    _, days_in_month = monthrange(year, month)
+    month_start = date(year, month, 1)
+    return month_start, month_start + timedelta(days=days_in_month)
+
+
+def parse_month(value, default=None):
+    """Parse a 'YYYY-MM' string into (year, month), falling back to the current month"""
+    try:
+        selected = datetime.strptime(value, '%Y-%m') if value else None
+    except ValueError:
+        selected = None
+    selected = selected or default or local_date()
+    return selected.year, selected.month
+
+
+def parse_month_strict(value):
+    """
+    Parse a 'YYYY-MM' string into (year, month) for write paths; a missing
+    value means the current month, a malformed one raises ValueError
+    """
+    if not value:
+        today = local_date()
+        return today.year, today.month
+    try:
+        selected = datetime.strptime(value.strip(), '%Y-%m')
+    except ValueError:
+        raise ValueError(f'Invalid month "{value}", expected YYYY-MM.')
+    return selected.year, selected.month
+
+
+def countable_days(year, month, today=None):
+    """
+    Number of days of the month that count towards attendance.
+
+    The current month counts up to today, past months count every day and
+    future months count none.
+    """
+    today = today or local_date()
+    _, days_in_month = monthrange(year, month)
+
+    if (year, month) == (today.year, today.month):
+        return min(today.day, days_in_month)
+    if (year, month) < (today.year, today.month):
+        return days_in_month
+    return 0
+
+
+@dataclass(frozen=True)
+class MonthlyPayroll:
+    """A labourer's attendance, deductions and payable amount for one month"""
+    labour_id: int
+    year: int
+    month: int
+    days_in_month: int
+    total_countable_days: int
+    present_days: int
+    absent_days: int
+    days_with_entries: int
+    total_entries: int
+    explicitly_absent: int
+    days_without_entries: int
+    is_current_month: bool
+    is_future_month: bool
+    penalty_days: int
+    total_penalty: float
+    penalty_per_day: float
+    allowed_absent_days: int
+    total_work_amount: float
+    insurance_amount: float
+    advance_amount: float
+    total_money_payable: float
+
+    @property
+    def month_year(self):
+        return date(self.year, self.month, 1).strftime('%B %Y')
+
+    @property
+    def present_percentage(self):
+        if self.total_countable_days <= 0:
+            return 0
+        return round((self.present_days / self.total_countable_days) * 100, 1)
+
+    @property
+    def absent_percentage(self):
+        if self.total_countable_days <= 0:
+            return 0
+        return round((self.absent_days / self.total_countable_days) * 100, 1)
+
+    def to_dict(self):
+        """Convert the payroll to a JSON-serialisable dictionary"""
+        result = asdict(self)
+        result['month_year'] = self.month_year
+        result['present_percentage'] = self.present_percentage
+        result['absent_percentage'] = self.absent_percentage
+        return result
+
+    def attendance_stats(self):
+        """The attendance_stats dict rendered by wage_card.html and labour_detail.html"""
+        return {
+            'month_year': self.month_year,
+            'days_in_month': self.days_in_month,
+            'total_countable_days': self.total_countable_days,
+            'present_days': self.present_days,
+            'absent_days': self.absent_days,
+            'days_with_entries': self.days_with_entries,    # Unique days with entries
+            'total_entries': self.total_entries,            # Total number of entries
+            'explicitly_absent': self.explicitly_absent,
+            'days_without_entries': self.days_without_entries,
+            'present_percentage': self.present_percentage,
+            'absent_percentage': self.absent_percentage,
+            'is_current_month': self.is_current_month,
+            'is_future_month': self.is_future_month,
+            # Penalty-related stats
+            'penalty_days': self.penalty_days,
+            'total_penalty': self.total_penalty,
+            'penalty_per_day': self.penalty_per_day,
+            'allowed_absent_days': self.allowed_absent_days,
+            'total_work_amount': self.total_work_amount,
+            'insurance_amount': self.insurance_amount
+        }
+
+
+def build_payroll(labour, year, month, present_days, explicitly_absent, days_with_entries,
+                  total_entries, total_work_amount, today=None):
+    """Apply the attendance, penalty, insurance and advance rules to a month's totals"""
+    today = today or local_date()
+    _, days_in_month = monthrange(year, month)
+    total_countable_days = countable_days(year, month, today)
+
+    # Days without any entries (neither present nor absent) count as absent
+    days_without_entries = total_countable_days - days_with_entries
+    absent_days = days_without_entries + explicitly_absent
+
+    deductions = labour.calculate_penalty(
+        absent_days,
+        penalty_per_day=PENALTY_PER_DAY,
+        allowed_absent_days=ALLOWED_ABSENT_DAYS,
+        insurance_amount=INSURANCE_AMOUNT
+    )
+    advance_amount = labour.advance_payment or 0.0  # Handle None case
+
+    return MonthlyPayroll(
+        labour_id=labour.id,
+        year=year,
+        month=month,
+        days_in_month=days_in_month,
+        total_countable_days=total_countable_days,
+        present_days=present_days,
+        absent_days=absent_days,
+        days_with_entries=days_with_entries,
+        total_entries=total_entries,
+        explicitly_absent=explicitly_absent,
+        days_without_entries=days_without_entries,
+        is_current_month=(year, month) == (today.year, today.month),
+        is_future_month=(year, month) > (today.year, today.month),
+        penalty_days=deductions['penalty_days'],
+        total_penalty=deductions['total_penalty'],
+        penalty_per_day=PENALTY_PER_DAY,
+        allowed_absent_days=ALLOWED_ABSENT_DAYS,
+        total_work_amount=total_work_amount,
+        insurance_amount=INSURANCE_AMOUNT,
+        advance_amount=advance_amount,
+        total_money_payable=total_work_amount - deductions['total_deductions'] - advance_amount
+    )
+
+
+def compute_month(labour, year, month):
+    """Compute a labourer's payroll for one month from the attendance bitmaps and daily rollup"""
+    month_start, next_month_start = month_bounds(year, month)
+    present_days, explicitly_absent, days_with_entries = attendance.attendance_counts(
+        *attendance.labour_month_masks(labour.id, month_start)
+    )
+    total_work_amount, total_entries = summary.get_month_totals(labour.id, month_start, next_month_start)
+
+    return build_payroll(
+        labour, year, month,
+        present_days=present_days,
+        explicitly_absent=explicitly_absent,
+        days_with_entries=days_with_entries,
+        total_entries=total_entries,
+        total_work_amount=total_work_amount
+    )
+
+
+def compute_month_bulk(year, month, labour_query=None):
+    """
+    Compute the month's payroll for many labourers from one grouped query.
+
+    The rollup is folded into per-day attendance and then per-labourer
+    totals in SQL and outer-joined to labour, so labourers without entries
+    are included (fully absent). Defaults to every active labourer.
+    """
+    month_start, next_month_start = month_bounds(year, month)
+
+    daily = db.session.query(
+        LabourDailySummary.labour_id,
+        LabourDailySummary.work_date,
+        func.sum(LabourDailySummary.present_count).label('present_count'),
+        func.sum(LabourDailySummary.entry_count).label('entry_count'),
+        func.sum(LabourDailySummary.amount).label('amount')
+    ).filter(
+        LabourDailySummary.work_date >= month_start,
+        LabourDailySummary.work_date < next_month_start
+    ).group_by(LabourDailySummary.labour_id, LabourDailySummary.work_date).subquery()
+
+    monthly = db.session.query(
+        daily.c.labour_id,
+        func.count(case((daily.c.present_count > 0, 1))).label('present_days'),
+        func.count(case((daily.c.present_count == 0, 1))).label('explicitly_absent'),
+        func.count().label('days_with_entries'),
+        func.sum(daily.c.entry_count).label('total_entries'),
+        func.sum(daily.c.amount).label('total_work_amount')
+    ).group_by(daily.c.labour_id).subquery()
+
+    labour_query = labour_query if labour_query is not None else Labour.query.filter(Labour.is_active == True)
+    rows = labour_query.outerjoin(monthly, monthly.c.labour_id == Labour.id).add_columns(
+        monthly.c.present_days,
+        monthly.c.explicitly_absent,
+        monthly.c.days_with_entries,
+        monthly.c.total_entries,
+        monthly.c.total_work_amount
+    ).order_by(Labour.id).all()
+
+    today = local_date()
+    return [
+        build_payroll(
+            labour, year, month,
+            present_days=present_days or 0,
+            explicitly_absent=explicitly_absent or 0,
+            days_with_entries=days_with_entries or 0,
+            total_entries=int(total_entries or 0),
+            total_work_amount=float(total_work_amount or 0),
+            today=today
+        )
+        for labour, present_days, explicitly_absent, days_with_entries, total_entries, total_work_amount in rows
+    ]
+
+
+def run_payroll(year, month, created_by=None):
+    """
+    Compute and store the month's payroll for every active labourer.
+
+    Returns the committed PayrollRun, including how long the run took and
+    how many labourers it processed.
+    """
+    started = time.perf_counter()
+    payrolls = compute_month_bulk(year, month)
+
+    run = PayrollRun(year=year, month=month, created_by=created_by)
+    db.session.add(run)
+    db.session.flush()
+
+    if payrolls:
+        db.session.execute(PayrollLine.__table__.insert(), [
+            {
+                'run_id': run.id,
+                'labour_id': item.labour_id,
+                'present_days': item.present_days,
+                'absent_days': item.absent_days,
+                'total_entries': item.total_entries,
+                'penalty_days': item.penalty_days,
+                'total_penalty': item.total_penalty,
+                'insurance_amount': item.insurance_amount,
+                'advance_amount': item.advance_amount,
+                'total_work_amount': item.total_work_amount,
+                'total_money_payable': item.total_money_payable
+            }
+            for item in payrolls
+        ])
+
+    run.labour_count = len(payrolls)
+    run.total_payable = sum(item.total_money_payable for item in payrolls)
+    run.duration_seconds = round(time.perf_counter() - started, 3)
+    db.session.commit()
+
+    return run
+
+
+def _from_snapshot(snapshot):
+    return MonthlyPayroll(**{field.name: getattr(snapshot, field.name) for field in fields(MonthlyPayroll)})
+
+
+def _month_index(year, month):
+    return year * 12 + month - 1
+
+
+def compute_history(labour, month_from, month_to):
+    """
+    Compute a labourer's payroll for every month in [month_from, month_to].
+
+    Open months come from one query grouping the daily rollup by month;
+    closed months are read from their snapshots with one more query.
+    Returns MonthlyPayroll objects in chronological order.
+    """
+    range_start, _ = month_bounds(month_from.year, month_from.month)
+    _, range_end = month_bounds(month_to.year, month_to.month)
+
+    snapshots = {
+        (snapshot.year, snapshot.month): snapshot
+        for snapshot in PayrollSnapshot.query.filter(
+            PayrollSnapshot.labour_id == labour.id,
+            func.make_date(PayrollSnapshot.year, PayrollSnapshot.month, 1).between(range_start, range_end)
+        )
+    }
+
+    daily = db.session.query(
+        LabourDailySummary.work_date,
+        func.sum(LabourDailySummary.present_count).label('present_count'),
+        func.sum(LabourDailySummary.entry_count).label('entry_count'),
+        func.sum(LabourDailySummary.amount).label('amount')
+    ).filter(
+        LabourDailySummary.labour_id == labour.id,
+        LabourDailySummary.work_date >= range_start,
+        LabourDailySummary.work_date < range_end
+    ).group_by(LabourDailySummary.work_date).subquery()
+
+    month_start = func.date_trunc('month', cast(daily.c.work_date, db.DateTime))
+    monthly = {
+        (row.month_start.year, row.month_start.month): row
+        for row in db.session.query(
+            month_start.label('month_start'),
+            func.count(case((daily.c.present_count > 0, 1))).label('present_days'),
+            func.count(case((daily.c.present_count == 0, 1))).label('explicitly_absent'),
+            func.count().label('days_with_entries'),
+            func.sum(daily.c.entry_count).label('total_entries'),
+            func.sum(daily.c.amount).label('total_work_amount')
+        ).group_by(month_start).all()
+    }
+
+    today = local_date()
+    history = []
+    for index in range(_month_index(month_from.year, month_from.month), _month_index(month_to.year, month_to.month) + 1):
+        year, month = divmod(index, 12)
+        month += 1
+
+        snapshot = snapshots.get((year, month))
+        if snapshot is not None:
+            history.append(_from_snapshot(snapshot))
+            continue
+
+        row = monthly.get((year, month))
+        history.append(build_payroll(
+            labour, year, month,
+            present_days=row.present_days if row else 0,
+            explicitly_absent=row.explicitly_absent if row else 0,
+            days_with_entries=row.days_with_entries if row else 0,
+            total_entries=int(row.total_entries or 0) if row else 0,
+            total_work_amount=float(row.total_work_amount or 0) if row else 0.0,
+            today=today
+        ))
+
+    return history
+
+
+def summarize_history(history):
+    """Total the earnings, attendance and deductions of a list of MonthlyPayroll"""
+    return {
+        'months': len(history),
+        'present_days': sum(item.present_days for item in history),
+        'absent_days': sum(item.absent_days for item in history),
+        'total_entries': sum(item.total_entries for item in history),
+        'total_work_amount': round(sum(item.total_work_amount for item in history), 2),
+        'total_penalty': round(sum(item.total_penalty for item in history), 2),
+        'insurance_amount': round(sum(item.insurance_amount for item in history if not item.is_future_month), 2)
+    }
+
+
+def is_closable(year, month, today=None):
+    """Only months that have fully ended can be closed"""
+    today = today or local_date()
+    return (year, month) < (today.year, today.month)
+
+
+def closed_months(keys):
+    """Return the (labour_id, year, month) keys that are already closed (have a snapshot)"""
+    keys = set(keys)
+    if not keys:
+        return set()
+    columns = (PayrollSnapshot.labour_id, PayrollSnapshot.year, PayrollSnapshot.month)
+    return {tuple(row) for row in db.session.query(*columns).filter(tuple_(*columns).in_(list(keys))).all()}
+
+
+def close_month(year, month, closed_by=None):
+    """
+    Freeze the month's payroll into one snapshot row per labourer.
+
+    Snapshots are immutable: labourers whose month is already closed are
+    left untouched. Returns the number of snapshots written.
+    """
+    if not is_closable(year, month):
+        raise ValueError(f'{year}-{month:02d} has not ended yet and cannot be closed')
+
+    payrolls = compute_month_bulk(year, month, labour_query=Labour.query)
+    if not payrolls:
+        return 0
+
+    statement = pg_insert(PayrollSnapshot).values([
+        dict(asdict(item), closed_at=datetime.utcnow(), closed_by=closed_by)
+        for item in payrolls
+    ]).on_conflict_do_nothing(index_elements=['labour_id', 'year', 'month'])
+    result = db.session.execute(statement)
+    db.session.commit()
+
+    return result.rowcount
+
+
+def get_month(labour, year, month):
+    """
+    Return a labourer's payroll for a month.
+
+    Closed months are served from their snapshot with one primary-key
+    lookup; open months are computed live from the rollup.
+    """
+    snapshot = PayrollSnapshot.query.get((labour.id, year, month))
+    if snapshot is not None:
+        return _from_snapshot(snapshot)
+
+    return compute_month(labour, year, month)
+
+
+WAGE_VERSION_KEY = 'wage'
+
+
+def get_month_cached(labour, year, month):
+    """
+    Return get_month() through the wage card cache keyed by (labour, year, month).
+
+    The key folds in the labourer's version (bumped when the advance
+    changes) and the labourer-month version (bumped on entry writes), plus
+    today's date for the open month since its countable days grow daily.
+
+    Wage cards carry payable amounts, so they are only cached when the
+    version counters are shared: with the memory backend a bump made by
+    one worker would leave the others serving stale cards.
+    """
+    if not versions().shared:
+        return get_month(labour, year, month)
+
+    today = local_date()
+    month_key = f'{year:04d}-{month:02d}'
+    day_key = today.isoformat() if (year, month) == (today.year, today.month) else '-'
+    digest = versions().digest([WAGE_VERSION_KEY, f'wage:{labour.id}', f'wage:{labour.id}:{month_key}'])
+
+    wage_cache = get_cache(
+        'wage-card',
+        maxsize=current_app.config['WAGE_CACHE_SIZE'],
+        ttl=current_app.config['WAGE_CACHE_TTL']
+    )
+    return wage_cache.get_or_compute(
+        f'{labour.id}:{month_key}:{day_key}:{digest}',
+        lambda: get_month(labour, year, month)
+    )
+
+
+def invalidate_entries(rows):
+    """Invalidate cached wage cards for the labourer-months of the given entries"""
+    versions().bump(
+        f"wage:{row['labour_id']}:{row['work_date'].year:04d}-{row['work_date'].month:02d}"
+        for row in rows
+    )
+
+
+def invalidate_labour(labour_id):
+    """Invalidate every cached wage card of a labourer, e.g. after an advance payment"""
+    versions().bump([f'wage:{labour_id}'])
+
+
+def invalidate_all():
+    """Invalidate every cached wage card, e.g. after a rollup rebuild"""
+    versions().bump([WAGE_VERSION_KEY])
+
+
+payroll_cli = AppGroup('payroll', help='Month-end payroll operations.')
+
+
+@payroll_cli.command('run')
+@click.option('--month', 'month_value', help='Month to run as YYYY-MM (default: current month).')
+def run_command(month_value):
+    """Compute and store payroll for every active labourer."""
+    try:
+        year, month = parse_month_strict(month_value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--month')
+    run = run_payroll(year, month)
+    click.echo(
+        f'Payroll run #{run.id} for {year}-{month:02d}: {run.labour_count} labourers, '
+        f'total payable AED {run.total_payable:,.2f}, took {run.duration_seconds:.3f}s.'
+    )
+
+
+@payroll_cli.command('close')
+@click.option('--month', 'month_value', required=True, help='Month to close as YYYY-MM.')
+def close_command(month_value):
+    """Freeze a finished month's payroll into immutable snapshots."""
+    try:
+        year, month = parse_month_strict(month_value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--month')
+    try:
+        written = close_month(year, month)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Closed {year}-{month:02d}: {written} payroll snapshots written.')
@@ -1,9 +1,19 @@
-from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify, make_response
-from models import User, Labour, Employee, Site, LabourEntry, db
-from sqlalchemy import func, and_, or_, case
+from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify, current_app, Response, stream_with_context, send_file
+from models import Labour, Employee, Site, LabourEntry, LabourDailySummary, db
+from cache import get_cache, versions
+import auth
+from sqlalchemy import func, case, cast
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import calendar
-from collections import defaultdict
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
 
 # Create blueprint
 report_bp = Blueprint('report', __name__)
@@ -45,34 +55,28 @@ def calculate_previous_period_dates(date_from, date_to):
     
     return prev_date_from, prev_date_to
 
-def get_labour_statistics(date_from, date_to, site_filter=None):
-    """Get comprehensive labour statistics for the given period"""
-    
-    # Base query
-    query = db.session.query(LabourEntry).filter(
-        LabourEntry.timestamp.between(date_from, date_to)
-    )
-    
-    # Apply site filter if provided
-    if site_filter and site_filter != 'all':
-        query = query.filter(LabourEntry.site_id == site_filter)
-    
-    entries = query.all()
-    
-    # Calculate statistics
-    total_hours = sum(entry.total_hours or 0 for entry in entries)
-    total_amount = sum(entry.amount or 0 for entry in entries)
-    
-    # Count present vs absent
-    present_count = sum(1 for entry in entries if entry.status.lower() == 'present')
-    absent_count = sum(1 for entry in entries if entry.status.lower() == 'absent')
-    total_entries = len(entries)
-    
-    # Count unique labourers worked
-    unique_labourers = len(set(entry.labour_id for entry in entries))
-    
-    # Count active sites
-    active_sites = len(set(entry.site_id for entry in entries))
+def _period_aggregates(date_from, date_to):
+    """Build the SUM/COUNT columns for one reporting period"""
+    in_period = LabourDailySummary.work_date.between(date_from.date(), date_to.date())
+    
+    return [
+        func.coalesce(func.sum(case((in_period, LabourDailySummary.total_hours))), 0),
+        func.coalesce(func.sum(case((in_period, LabourDailySummary.amount))), 0),
+        func.coalesce(func.sum(case((in_period, LabourDailySummary.present_count))), 0),
+        func.coalesce(func.sum(case((in_period, LabourDailySummary.absent_count))), 0),
+        func.coalesce(func.sum(case((in_period, LabourDailySummary.entry_count))), 0),
+        func.count(func.distinct(case((in_period, LabourDailySummary.labour_id)))),
+        func.count(func.distinct(case((in_period, LabourDailySummary.site_id))))
+    ]
+
+def _build_statistics(row, date_from, date_to):
+    """Turn the raw aggregates of one period into the statistics dict"""
+    total_hours, total_amount, present_count, absent_count, total_entries, unique_labourers, active_sites = row
+    total_hours = float(total_hours or 0)
+    total_amount = float(total_amount or 0)
+    present_count = int(present_count or 0)
+    absent_count = int(absent_count or 0)
+    total_entries = int(total_entries or 0)
     
     # Calculate average daily hours
     days_in_period = (date_to - date_from).days + 1
@@ -94,73 +98,151 @@ def get_labour_statistics(date_from, date_to, site_filter=None):
         'attendance_rate': round((present_count / total_entries * 100) if total_entries > 0 else 0, 2)
     }
 
-def get_site_wise_statistics(date_from, date_to):
+def get_period_statistics(periods, site_filter=None):
+    """
+    Get labour statistics for several (date_from, date_to) periods at once.
+    
+    All periods are aggregated from the daily summary rollup by a single
+    query using conditional SUM/COUNT(DISTINCT) columns, so no entry rows
+    are loaded into Python.
+    Returns one statistics dict per period, in the same order.
+    """
+    columns = []
+    for date_from, date_to in periods:
+        columns.extend(_period_aggregates(date_from, date_to))
+    
+    query = db.session.query(*columns).filter(
+        LabourDailySummary.work_date.between(
+            min(date_from for date_from, _ in periods).date(),
+            max(date_to for _, date_to in periods).date()
+        )
+    )
+    
+    # Apply site filter if provided
+    if site_filter and site_filter != 'all':
+        query = query.filter(LabourDailySummary.site_id == site_filter)
+    
+    row = query.one()
+    
+    width = len(columns) // len(periods)
+    return [
+        _build_statistics(row[index * width:(index + 1) * width], date_from, date_to)
+        for index, (date_from, date_to) in enumerate(periods)
+    ]
+
+REPORT_VERSION_KEY = 'report'
+
+def _entry_version_keys(date_from, date_to, site_filter=None):
+    """Version counter keys covering every (site, day) in the period"""
+    scope = site_filter if site_filter and site_filter != 'all' else 'all'
+    first_day = date_from.date()
+    days = (date_to.date() - first_day).days + 1
+    
+    return [f'entries:{scope}:{(first_day + timedelta(days=offset)).isoformat()}' for offset in range(days)]
+
+def cached_report_result(name, date_from, date_to, site_filter, compute):
+    """
+    Return a cached aggregation keyed by (date_from, date_to, site_id).
+    
+    The key includes the entry versions of every day in the period, so an
+    entry write only invalidates results covering that site and day, plus
+    a report-wide version bumped by invalidate_all().
+    
+    Results are only cached when the version counters are shared (filesystem
+    or redis backend); with per-worker memory counters a write handled by
+    one worker would leave the others serving stale aggregates.
+    """
+    if not versions().shared:
+        return compute()
+    
+    report_cache = get_cache(
+        'report',
+        maxsize=current_app.config['REPORT_CACHE_SIZE'],
+        ttl=current_app.config['REPORT_CACHE_TTL']
+    )
+    digest = versions().digest([REPORT_VERSION_KEY] + _entry_version_keys(date_from, date_to, site_filter))
+    key = f"{name}:{date_from.date()}:{date_to.date()}:{site_filter or 'all'}:{digest}"
+    
+    return report_cache.get_or_compute(key, compute)
+
+def invalidate_entries(rows):
+    """Bump the per-site and all-sites versions of each entry's day"""
+    keys = []
+    for row in rows:
+        day = row['work_date'].isoformat()
+        keys.append(f"entries:{row['site_id']}:{day}")
+        keys.append(f'entries:all:{day}')
+    
+    versions().bump(keys)
+
+def invalidate_all():
+    """Invalidate every cached report, e.g. after a rollup rebuild or renaming a site or labourer"""
+    versions().bump([REPORT_VERSION_KEY])
+
+def get_labour_statistics(date_from, date_to, site_filter=None):
+    """Get comprehensive labour statistics for the given period"""
+    return get_period_statistics([(date_from, date_to)], site_filter)[0]
+
+def get_site_wise_statistics(date_from, date_to, site_filter=None):
     """Get site-wise breakdown of statistics"""
     
-    # Query all entries in the date range
-    entries = db.session.query(LabourEntry).filter(
-        LabourEntry.timestamp.between(date_from, date_to)
-    ).all()
+    total_entries = func.sum(LabourDailySummary.entry_count)
+    attendance_rate = func.coalesce(
+        func.sum(LabourDailySummary.present_count) * 100.0 / func.nullif(total_entries, 0), 0
+    )
     
-    # Group by site
-    site_stats = defaultdict(lambda: {
-        'total_hours': 0,
-        'total_amount': 0,
-        'present_count': 0,
-        'absent_count': 0,
-        'unique_labourers': set(),
-        'site_name': '',
-        'site_location': ''
-    })
-    
-    for entry in entries:
-        site_id = entry.site_id
-        site_stats[site_id]['total_hours'] += entry.total_hours or 0
-        site_stats[site_id]['total_amount'] += entry.amount or 0
-        site_stats[site_id]['unique_labourers'].add(entry.labour_id)
-        site_stats[site_id]['site_name'] = entry.site.name
-        site_stats[site_id]['site_location'] = entry.site.location
-        
-        if entry.status.lower() == 'present':
-            site_stats[site_id]['present_count'] += 1
-        else:
-            site_stats[site_id]['absent_count'] += 1
+    # Group the daily rollup by site, joined to sites for name and location
+    query = db.session.query(
+        Site.id.label('site_id'),
+        Site.name.label('site_name'),
+        Site.location.label('site_location'),
+        func.coalesce(func.sum(LabourDailySummary.total_hours), 0).label('total_hours'),
+        func.coalesce(func.sum(LabourDailySummary.amount), 0).label('total_amount'),
+        func.count(func.distinct(LabourDailySummary.labour_id)).label('unique_labourers'),
+        total_entries.label('total_entries'),
+        attendance_rate.label('attendance_rate')
+    ).join(Site, LabourDailySummary.site_id == Site.id).filter(
+        LabourDailySummary.work_date.between(date_from.date(), date_to.date())
+    )
     
-    # Convert to list and calculate additional metrics
-    result = []
-    for site_id, stats in site_stats.items():
-        total_entries = stats['present_count'] + stats['absent_count']
-        attendance_rate = (stats['present_count'] / total_entries * 100) if total_entries > 0 else 0
-        
-        result.append({
-            'site_id': site_id,
-            'site_name': stats['site_name'],
-            'site_location': stats['site_location'],
-            'total_hours': round(stats['total_hours'], 2),
-            'total_amount': round(stats['total_amount'], 2),
-            'unique_labourers': len(stats['unique_labourers']),
-            'total_entries': total_entries,
-            'attendance_rate': round(attendance_rate, 2)
-        })
+    # Apply site filter if provided
+    if site_filter and site_filter != 'all':
+        query = query.filter(LabourDailySummary.site_id == site_filter)
     
-    return sorted(result, key=lambda x: x['total_hours'], reverse=True)
+    rows = query.group_by(Site.id, Site.name, Site.location).order_by(
+        func.sum(LabourDailySummary.total_hours).desc()
+    ).all()
+    
+    return [
+        {
+            'site_id': row.site_id,
+            'site_name': row.site_name,
+            'site_location': row.site_location,
+            'total_hours': round(float(row.total_hours), 2),
+            'total_amount': round(float(row.total_amount), 2),
+            'unique_labourers': row.unique_labourers,
+            'total_entries': int(row.total_entries or 0),
+            'attendance_rate': round(float(row.attendance_rate), 2)
+        }
+        for row in rows
+    ]
 
 def get_labour_performance_data(date_from, date_to, limit=10):
     """Get top performing labourers"""
     
-    # Query and group by labour
+    # Query the daily rollup and group by labour
     performance_data = db.session.query(
-        LabourEntry.labour_id,
+        LabourDailySummary.labour_id,
         Labour.name,
         Labour.labour_id.label('labour_code'),
-        func.sum(LabourEntry.total_hours).label('total_hours'),
-        func.sum(LabourEntry.amount).label('total_amount'),
-        func.count(LabourEntry.id).label('total_entries'),
-        func.sum(case((LabourEntry.status == 'Present', 1), else_=0)).label('present_count')
-    ).join(Labour, LabourEntry.labour_id == Labour.id).filter(
-        LabourEntry.timestamp.between(date_from, date_to)
-    ).group_by(LabourEntry.labour_id, Labour.name, Labour.labour_id).order_by(
-        func.sum(LabourEntry.total_hours).desc()
+        func.sum(LabourDailySummary.total_hours).label('total_hours'),
+        func.sum(LabourDailySummary.amount).label('total_amount'),
+        func.sum(LabourDailySummary.entry_count).label('total_entries'),
+        func.sum(LabourDailySummary.present_count).label('present_count')
+    ).join(Labour, LabourDailySummary.labour_id == Labour.id).filter(
+        LabourDailySummary.work_date.between(date_from.date(), date_to.date())
+    ).group_by(LabourDailySummary.labour_id, Labour.name, Labour.labour_id).order_by(
+        func.sum(LabourDailySummary.total_hours).desc()
     ).limit(limit).all()
     
     result = []
@@ -250,6 +332,37 @@ def generate_report_metrics(current_stats, previous_stats):
     
     return metrics
 
+def get_report_data(date_from_obj, date_to_obj, site_filter):
+    """Compute (or fetch from cache) every aggregation shown on /report"""
+    # Calculate previous period dates
+    prev_date_from, prev_date_to = calculate_previous_period_dates(date_from_obj, date_to_obj)
+    
+    # Get current and previous period statistics in one round trip
+    current_stats, previous_stats = cached_report_result(
+        'period-stats', prev_date_from, date_to_obj, site_filter,
+        lambda: get_period_statistics(
+            [(date_from_obj, date_to_obj), (prev_date_from, prev_date_to)],
+            site_filter
+        )
+    )
+    
+    # Generate comparison metrics
+    report_data = generate_report_metrics(current_stats, previous_stats)
+    
+    # Get site-wise statistics
+    site_wise_stats = cached_report_result(
+        'site-wise', date_from_obj, date_to_obj, site_filter,
+        lambda: get_site_wise_statistics(date_from_obj, date_to_obj, site_filter)
+    )
+    
+    # Get labour performance data
+    labour_performance = cached_report_result(
+        'top-performers', date_from_obj, date_to_obj, 'all',
+        lambda: get_labour_performance_data(date_from_obj, date_to_obj)
+    )
+    
+    return current_stats, report_data, site_wise_stats, labour_performance
+
 @report_bp.route('/report')
 def report():
     # Check if user is logged in
@@ -257,7 +370,7 @@ def report():
         return redirect(url_for('login'))
     
     # Get user data
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user:
         return redirect(url_for('login'))
     
@@ -267,23 +380,10 @@ def report():
     # Get site filter
     site_filter = request.args.get('site_id', 'all')
     
-    # Calculate previous period dates
-    prev_date_from, prev_date_to = calculate_previous_period_dates(date_from_obj, date_to_obj)
-    
-    # Get current period statistics
-    current_stats = get_labour_statistics(date_from_obj, date_to_obj, site_filter)
-    
-    # Get previous period statistics for comparison
-    previous_stats = get_labour_statistics(prev_date_from, prev_date_to, site_filter)
-    
-    # Generate comparison metrics
-    report_data = generate_report_metrics(current_stats, previous_stats)
-    
-    # Get site-wise statistics
-    site_wise_stats = get_site_wise_statistics(date_from_obj, date_to_obj)
-    
-    # Get labour performance data
-    labour_performance = get_labour_performance_data(date_from_obj, date_to_obj)
+    # Get statistics, comparison metrics, site-wise and performance data
+    current_stats, report_data, site_wise_stats, labour_performance = get_report_data(
+        date_from_obj, date_to_obj, site_filter
+    )
     
     # Get all sites for filter dropdown
     sites = Site.query.all()
@@ -315,6 +415,68 @@ def report():
                             'days': (date_to_obj - date_from_obj).days + 1
                         })
 
+CHART_GRANULARITIES = ('day', 'week', 'month')
+
+def _bucket_start(value, granularity):
+    """Truncate a date to the start of its chart bucket"""
+    if granularity == 'week':
+        return value - timedelta(days=value.weekday())
+    if granularity == 'month':
+        return value.replace(day=1)
+    return value
+
+def _next_bucket(value, granularity):
+    """Return the start of the bucket following the given one"""
+    if granularity == 'week':
+        return value + timedelta(days=7)
+    if granularity == 'month':
+        _, days_in_month = calendar.monthrange(value.year, value.month)
+        return value + timedelta(days=days_in_month)
+    return value + timedelta(days=1)
+
+def get_time_series(date_from, date_to, granularity='day', site_filter=None):
+    """
+    Get hours, amount and attendance per day/week/month bucket.
+    
+    Every bucket is aggregated from the daily summary rollup by one
+    GROUP BY date_trunc(...) query and buckets without entries are filled
+    with zeros.
+    """
+    bucket = func.date_trunc(granularity, cast(LabourDailySummary.work_date, db.DateTime)).label('bucket')
+    
+    query = db.session.query(
+        bucket,
+        func.coalesce(func.sum(LabourDailySummary.total_hours), 0).label('total_hours'),
+        func.coalesce(func.sum(LabourDailySummary.amount), 0).label('total_amount'),
+        func.coalesce(func.sum(LabourDailySummary.present_count), 0).label('present_count'),
+        func.coalesce(func.sum(LabourDailySummary.entry_count), 0).label('total_entries')
+    ).filter(
+        LabourDailySummary.work_date.between(date_from.date(), date_to.date())
+    )
+    
+    if site_filter and site_filter != 'all':
+        query = query.filter(LabourDailySummary.site_id == site_filter)
+    
+    rows = {row.bucket.date(): row for row in query.group_by(bucket).all()}
+    
+    series = []
+    current = _bucket_start(date_from.date(), granularity)
+    while current <= date_to.date():
+        row = rows.get(current)
+        total_entries = row.total_entries if row else 0
+        present_count = row.present_count if row else 0
+        
+        series.append({
+            'date': current.strftime('%Y-%m-%d'),
+            'hours': round(float(row.total_hours) if row else 0, 2),
+            'amount': round(float(row.total_amount) if row else 0, 2),
+            'attendance': round((present_count / total_entries * 100) if total_entries > 0 else 0, 2)
+        })
+        
+        current = _next_bucket(current, granularity)
+    
+    return series
+
 @report_bp.route('/report/api/chart-data')
 def chart_data():
     """API endpoint for chart data"""
@@ -324,24 +486,13 @@ def chart_data():
     # Get date range
     date_from_obj, date_to_obj, _, _ = get_date_range_from_request()
     
-    # Get daily statistics for charts
-    daily_stats = []
-    current_date = date_from_obj
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in CHART_GRANULARITIES:
+        return jsonify({'error': f'granularity must be one of {", ".join(CHART_GRANULARITIES)}'}), 400
     
-    while current_date <= date_to_obj:
-        next_date = current_date + timedelta(days=1)
-        day_stats = get_labour_statistics(current_date, next_date)
-        
-        daily_stats.append({
-            'date': current_date.strftime('%Y-%m-%d'),
-            'hours': day_stats['total_hours'],
-            'amount': day_stats['total_amount'],
-            'attendance': day_stats['attendance_rate']
-        })
-        
-        current_date = next_date
+    site_filter = request.args.get('site_id', 'all')
     
-    return jsonify(daily_stats)
+    return jsonify(get_time_series(date_from_obj, date_to_obj, granularity, site_filter))
 
 # Export routes can be added here
 @report_bp.route('/report/export/pdf')
@@ -349,12 +500,265 @@ def export_pdf():
     # Implementation for PDF export
     return "PDF export functionality to be implemented"
 
+_export_executor = None
+_export_executor_lock = threading.Lock()
+
+def count_export_rows(date_from, date_to, site_filter=None):
+    """Count the entries an export would contain, using the daily rollup"""
+    query = db.session.query(
+        func.coalesce(func.sum(LabourDailySummary.entry_count), 0)
+    ).filter(
+        LabourDailySummary.work_date.between(date_from.date(), date_to.date())
+    )
+    
+    if site_filter and site_filter != 'all':
+        query = query.filter(LabourDailySummary.site_id == site_filter)
+    
+    return int(query.scalar())
+
+def write_excel_report(target, date_from_obj, date_to_obj, site_filter):
+    """
+    Write the report workbook to `target` (a path or binary file object).
+    
+    The workbook is created in openpyxl's write-only mode, so rows are
+    flushed to disk as they are appended instead of being held in memory.
+    """
+    from openpyxl import Workbook
+    
+    _, report_data, site_wise_stats, labour_performance = get_report_data(
+        date_from_obj, date_to_obj, site_filter
+    )
+    
+    workbook = Workbook(write_only=True)
+    
+    sheet = workbook.create_sheet('Summary')
+    sheet.append(['Metric', 'Current Period', 'Previous Period', 'Change (%)', 'Status'])
+    for item in report_data:
+        sheet.append([item['metric'], item['current'], item['previous'], item['change'], item['status']])
+    
+    sheet = workbook.create_sheet('Site-wise')
+    sheet.append(['Site', 'Location', 'Total Hours', 'Total Amount', 'Labourers', 'Entries', 'Attendance Rate (%)'])
+    for site in site_wise_stats:
+        sheet.append([
+            site['site_name'], site['site_location'], site['total_hours'], site['total_amount'],
+            site['unique_labourers'], site['total_entries'], site['attendance_rate']
+        ])
+    
+    sheet = workbook.create_sheet('Top Labourers')
+    sheet.append(['Labour ID', 'Name', 'Total Hours', 'Total Amount', 'Entries', 'Attendance Rate (%)'])
+    for labour in labour_performance:
+        sheet.append([
+            labour['labour_code'], labour['name'], labour['total_hours'], labour['total_amount'],
+            labour['total_entries'], labour['attendance_rate']
+        ])
+    
+    sheet = workbook.create_sheet('Entries')
+    sheet.append(EXPORT_COLUMNS)
+    for row in iter_export_rows(date_from_obj, date_to_obj, site_filter):
+        sheet.append(list(row))
+    
+    workbook.save(target)
+
+def _export_dir():
+    export_dir = current_app.config['EXPORT_DIR']
+    os.makedirs(export_dir, exist_ok=True)
+    return export_dir
+
+def _job_paths(job_id):
+    export_dir = _export_dir()
+    return os.path.join(export_dir, f'{job_id}.json'), os.path.join(export_dir, f'{job_id}.xlsx')
+
+def _write_job_status(job_id, **status):
+    status_path, _ = _job_paths(job_id)
+    temp_path = f'{status_path}.tmp'
+    with open(temp_path, 'w') as handle:
+        json.dump(status, handle)
+    os.replace(temp_path, status_path)
+
+def _read_job_status(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    status_path, _ = _job_paths(job_id)
+    try:
+        with open(status_path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+def _sweep_exports():
+    """Delete export workbooks and job files older than EXPORT_RETENTION"""
+    export_dir = _export_dir()
+    cutoff = time.time() - current_app.config['EXPORT_RETENTION']
+    for name in os.listdir(export_dir):
+        path = os.path.join(export_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # removed concurrently by another worker
+
+def _get_export_executor():
+    global _export_executor
+    with _export_executor_lock:
+        if _export_executor is None:
+            _export_executor = ThreadPoolExecutor(
+                max_workers=current_app.config['EXPORT_WORKERS'],
+                thread_name_prefix='report-export'
+            )
+        return _export_executor
+
+def _run_excel_export_job(app, job_id, user_id, date_from_obj, date_to_obj, site_filter, filename):
+    """Build an Excel export in the background and record its status"""
+    with app.app_context():
+        _, excel_path = _job_paths(job_id)
+        _write_job_status(job_id, status='running', filename=filename, user_id=user_id)
+        try:
+            write_excel_report(f'{excel_path}.part', date_from_obj, date_to_obj, site_filter)
+            os.replace(f'{excel_path}.part', excel_path)
+            _write_job_status(job_id, status='done', filename=filename, user_id=user_id)
+        except Exception as e:
+            app.logger.exception(e)
+            _write_job_status(job_id, status='failed', filename=filename, user_id=user_id)
+        finally:
+            db.session.remove()
+
 @report_bp.route('/report/export/excel')
 def export_excel():
-    # Implementation for Excel export
-    return "Excel export functionality to be implemented"
+    """Export the report as .xlsx, in the background for large periods"""
+    user = auth.current_user()
+    if 'user_id' not in session or not user:
+        return redirect(url_for('login'))
+    
+    date_from_obj, date_to_obj, date_from, date_to = get_date_range_from_request()
+    site_filter = request.args.get('site_id', 'all')
+    filename = f'labour_report_{date_from}_{date_to}.xlsx'
+    
+    if count_export_rows(date_from_obj, date_to_obj, site_filter) <= current_app.config['EXPORT_ASYNC_ROW_THRESHOLD']:
+        workbook_file = tempfile.TemporaryFile()
+        write_excel_report(workbook_file, date_from_obj, date_to_obj, site_filter)
+        workbook_file.seek(0)
+        return send_file(
+            workbook_file,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=filename
+        )
+    
+    # Large export: hand it to a background worker and show a download page
+    _sweep_exports()
+    job_id = uuid.uuid4().hex
+    _write_job_status(job_id, status='queued', filename=filename, user_id=user.id)
+    _get_export_executor().submit(
+        _run_excel_export_job, current_app._get_current_object(),
+        job_id, user.id, date_from_obj, date_to_obj, site_filter, filename
+    )
+    
+    return render_template('export_job.html', job_id=job_id, filename=filename), 202
+
+@report_bp.route('/report/export/jobs/<job_id>')
+def export_job_status(job_id):
+    """API endpoint reporting the status of a background export"""
+    user = auth.current_user()
+    if 'user_id' not in session or not user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    status = _read_job_status(job_id)
+    if status is None or status.get('user_id') != user.id:
+        return jsonify({'error': 'Export job not found'}), 404
+    
+    if status['status'] == 'done':
+        status['download_url'] = url_for('report.download_export', job_id=job_id)
+    
+    return jsonify(status)
+
+@report_bp.route('/report/export/jobs/<job_id>/download')
+def download_export(job_id):
+    """Download the workbook produced by a finished background export"""
+    user = auth.current_user()
+    if 'user_id' not in session or not user:
+        return redirect(url_for('login'))
+    
+    # Only the admin who started an export may download it
+    status = _read_job_status(job_id)
+    if status is None or status.get('user_id') != user.id or status['status'] != 'done':
+        return jsonify({'error': 'Export is not ready'}), 404
+    
+    _, excel_path = _job_paths(job_id)
+    return send_file(
+        excel_path,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=status['filename']
+    )
+
+EXPORT_COLUMNS = [
+    'Entry ID', 'Timestamp', 'Labour ID', 'Labour Name', 'Site', 'Site Location',
+    'Recorded By', 'Activity', 'Status', 'Unit', 'Rate Type', 'Rate',
+    'Total Hours', 'Qty', 'Amount'
+]
+
+def iter_export_rows(date_from, date_to, site_filter=None, batch_size=1000):
+    """
+    Yield export rows for labour entries joined with labour, site and employee.
+    
+    Rows are fetched through a server-side cursor in batches of
+    `batch_size`, so memory stays constant however large the range is.
+    """
+    query = db.session.query(
+        LabourEntry.id,
+        LabourEntry.timestamp,
+        Labour.labour_id,
+        Labour.name,
+        Site.name,
+        Site.location,
+        Employee.username,
+        LabourEntry.activity,
+        LabourEntry.status,
+        LabourEntry.unit,
+        LabourEntry.rate_type,
+        LabourEntry.rate,
+        LabourEntry.total_hours,
+        LabourEntry.qty,
+        LabourEntry.amount
+    ).join(Labour, LabourEntry.labour_id == Labour.id).join(
+        Site, LabourEntry.site_id == Site.id
+    ).join(
+        Employee, LabourEntry.employee_id == Employee.id
+    ).filter(
+        LabourEntry.work_date.between(date_from.date(), date_to.date())
+    )
+    
+    if site_filter and site_filter != 'all':
+        query = query.filter(LabourEntry.site_id == site_filter)
+    
+    for row in query.order_by(LabourEntry.work_date, LabourEntry.timestamp, LabourEntry.id).yield_per(batch_size):
+        yield row
+
+class _CSVLine:
+    """Minimal file-like object so csv.writer returns each formatted line"""
+    def write(self, value):
+        return value
 
 @report_bp.route('/report/export/csv')
 def export_csv():
-    # Implementation for CSV export
-    return "CSV export functionality to be implemented"
\ No newline at end of file
+    """Stream labour entries for the selected period and site as CSV"""
+    if 'user_id' not in session or not auth.current_user():
+        return redirect(url_for('login'))
+    
+    date_from_obj, date_to_obj, date_from, date_to = get_date_range_from_request()
+    site_filter = request.args.get('site_id', 'all')
+    
+    def generate():
+        writer = csv.writer(_CSVLine())
+        yield writer.writerow(EXPORT_COLUMNS)
+        
+        for row in iter_export_rows(date_from_obj, date_to_obj, site_filter):
+            entry_id, timestamp, *values = row
+            yield writer.writerow([entry_id, timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp else ''] + values)
+    
+    filename = f'labour_entries_{date_from}_{date_to}.csv'
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
\ No newline at end of file
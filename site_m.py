@@ -1,5 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from models import db, User, Site
+from models import db, Site
+import auth
+import counters
+import invalidation
+import report
 
 # Create blueprint
 site_bp = Blueprint('site', __name__)
@@ -10,7 +14,7 @@ def site_m():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('site_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -41,6 +45,7 @@ def site_m():
                     created_by=session['user_id']
                 )
                 db.session.add(new_site)
+                counters.adjust('sites', 1)
                 db.session.commit()
                 flash(f'Site "{site_name}" has been added successfully.', 'success')
             
@@ -57,6 +62,7 @@ def site_m():
                 site.name = site_name
                 site.location = location
                 db.session.commit()
+                report.invalidate_all()  # site-wise statistics show the name
                 flash(f'Site "{site_name}" has been updated successfully.', 'success')
             
             else:
@@ -77,7 +83,7 @@ def delete_site():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('site_m'):
         flash('You do not have permission to access this page.', 'danger')
         return redirect(url_for('admin.admin_dashboard'))
@@ -98,7 +104,9 @@ def delete_site():
             return redirect(url_for('site.site_m'))
         
         db.session.delete(site)
+        counters.adjust('sites', -1)
         db.session.commit()
+        invalidation.everything_changed()
         
         flash(f'Site "{site_name}" has been deleted successfully.', 'success')
         
@@ -116,7 +124,7 @@ def get_site(site_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('site_m'):
         return jsonify({'error': 'Permission denied'}), 403
     
@@ -130,7 +138,7 @@ def get_all_sites():
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user = User.query.get(session['user_id'])
+    user = auth.current_user()
     if not user or not user.has_permission('site_m'):
         return jsonify({'error': 'Permission denied'}), 403
     
@@ -0,0 +1,166 @@
+"""
+Maintenance of the labour_daily_summary rollup table.
+
+Every write to labour_entries must be mirrored here inside the same
+transaction via apply_entries(), so reports and wage computations can read
+one row per (work_date, site, labour, activity) instead of raw entries.
+The attendance bitmaps derived from the rollup are refreshed alongside.
+"""
+from collections import defaultdict
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, case, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import attendance
+import invalidation
+from models import db, local_date, LabourEntry, LabourDailySummary
+
+KEY_COLUMNS = ('work_date', 'site_id', 'labour_id', 'activity')
+VALUE_COLUMNS = ('entry_count', 'present_count', 'absent_count', 'total_hours', 'qty', 'amount')
+ENTRY_COLUMNS = ('work_date', 'timestamp', 'site_id', 'labour_id', 'activity', 'status', 'total_hours', 'qty', 'amount')
+
+
+def entry_row(entry):
+    """Snapshot the fields of a LabourEntry that feed the rollup"""
+    return values_row({column: getattr(entry, column) for column in ENTRY_COLUMNS})
+
+
+def values_row(values):
+    """Snapshot a dict of labour_entries column values, e.g. from a bulk insert"""
+    row = {column: values.get(column) for column in ENTRY_COLUMNS if column != 'timestamp'}
+    # Dicts built without a work_date fall back to their timestamp
+    row['work_date'] = row['work_date'] or local_date(values.get('timestamp'))
+    return row
+
+
+def _deltas(added, removed):
+    """Fold entry snapshots into signed per-key deltas"""
+    deltas = defaultdict(lambda: dict.fromkeys(VALUE_COLUMNS, 0))
+
+    for sign, rows in ((1, added), (-1, removed)):
+        for row in rows:
+            delta = deltas[tuple(row[column] for column in KEY_COLUMNS)]
+            status = (row['status'] or '').lower()
+            delta['entry_count'] += sign
+            delta['present_count'] += sign if status == 'present' else 0
+            delta['absent_count'] += sign if status == 'absent' else 0
+            delta['total_hours'] += sign * (row['total_hours'] or 0)
+            delta['qty'] += sign * (row['qty'] or 0)
+            delta['amount'] += sign * (row['amount'] or 0)
+
+    return deltas
+
+
+def apply_entries(added=(), removed=()):
+    """
+    Apply added/removed entry snapshots (see entry_row) to the rollup.
+
+    Runs in the caller's transaction: the caller commits or rolls back
+    together with the labour_entries change. An edit is expressed as the old
+    snapshot in `removed` and the new one in `added`.
+    """
+    deltas = _deltas(added, removed)
+    if not deltas:
+        return
+
+    values = [
+        dict(zip(KEY_COLUMNS, key), **delta)
+        for key, delta in deltas.items()
+    ]
+
+    statement = pg_insert(LabourDailySummary).values(values)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(KEY_COLUMNS),
+        set_={
+            column: getattr(LabourDailySummary, column) + getattr(statement.excluded, column)
+            for column in VALUE_COLUMNS
+        }
+    )
+    db.session.execute(statement)
+
+    # Drop rows whose last entry was removed
+    if removed:
+        db.session.query(LabourDailySummary).filter(
+            tuple_(*(getattr(LabourDailySummary, column) for column in KEY_COLUMNS)).in_(list(deltas)),
+            LabourDailySummary.entry_count <= 0
+        ).delete(synchronize_session=False)
+
+    attendance.refresh(
+        (labour_id, site_id, work_date.replace(day=1))
+        for work_date, site_id, labour_id, _ in deltas
+    )
+
+
+def rebuild(date_from=None, date_to=None):
+    """
+    Recompute the rollup from labour_entries, optionally for a date range.
+
+    Returns the number of summary rows written.
+    """
+    work_date = LabourEntry.work_date
+    status = func.lower(LabourEntry.status)
+
+    delete_query = db.session.query(LabourDailySummary)
+    source = db.session.query(
+        work_date,
+        LabourEntry.site_id,
+        LabourEntry.labour_id,
+        LabourEntry.activity,
+        func.count(LabourEntry.id),
+        func.count(case((status == 'present', 1))),
+        func.count(case((status == 'absent', 1))),
+        func.coalesce(func.sum(LabourEntry.total_hours), 0),
+        func.coalesce(func.sum(LabourEntry.qty), 0),
+        func.coalesce(func.sum(LabourEntry.amount), 0)
+    )
+
+    if date_from:
+        delete_query = delete_query.filter(LabourDailySummary.work_date >= date_from)
+        source = source.filter(work_date >= date_from)
+    if date_to:
+        delete_query = delete_query.filter(LabourDailySummary.work_date <= date_to)
+        source = source.filter(work_date <= date_to)
+
+    source = source.group_by(work_date, LabourEntry.site_id, LabourEntry.labour_id, LabourEntry.activity)
+
+    delete_query.delete(synchronize_session=False)
+    result = db.session.execute(
+        LabourDailySummary.__table__.insert().from_select(
+            list(KEY_COLUMNS + VALUE_COLUMNS), source.statement
+        )
+    )
+    attendance.rebuild(date_from, date_to)
+    return result.rowcount
+
+
+def get_month_totals(labour_id, month_start, next_month_start):
+    """Return (total_work_amount, total_entries) of a labourer for [month_start, next_month_start)"""
+    total_work_amount, total_entries = db.session.query(
+        func.coalesce(func.sum(LabourDailySummary.amount), 0),
+        func.coalesce(func.sum(LabourDailySummary.entry_count), 0)
+    ).filter(
+        LabourDailySummary.labour_id == labour_id,
+        LabourDailySummary.work_date >= month_start,
+        LabourDailySummary.work_date < next_month_start
+    ).one()
+
+    return float(total_work_amount), int(total_entries)
+
+
+summary_cli = AppGroup('summary', help='Maintain the labour daily summary rollup.')
+
+
+@summary_cli.command('rebuild')
+@click.option('--date-from', type=click.DateTime(formats=['%Y-%m-%d']), help='First work date to rebuild.')
+@click.option('--date-to', type=click.DateTime(formats=['%Y-%m-%d']), help='Last work date to rebuild.')
+def rebuild_command(date_from, date_to):
+    """Backfill or rebuild labour_daily_summary (and attendance bitmaps) from labour_entries."""
+    rows = rebuild(
+        date_from.date() if date_from else None,
+        date_to.date() if date_to else None
+    )
+    db.session.commit()
+    invalidation.everything_changed()
+    click.echo(f'Rebuilt labour daily summary: {rows} rows written.')
@@ -0,0 +1,180 @@
+"""
+Login throttling with token buckets.
+
+Every /login POST takes a token from a bucket keyed by the client IP,
+before any database lookup or password hash, and is refused while the
+bucket keyed by the attempted identifier is empty. A successful login
+gives its IP token back and the identifier bucket is only charged for
+failed logins, so a crew logging in from one NAT address at shift start
+is not throttled and nobody can lock out an account without guessing its
+password wrong. Behind a reverse proxy set TRUSTED_PROXIES so the client
+IP comes from X-Forwarded-For.
+Buckets live in this worker's memory, or in Redis when
+THROTTLE_STORAGE=redis so all workers share them. Limits are written as
+'attempts/seconds': a bucket holds `attempts` tokens and refills at
+attempts/seconds tokens per second.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# Token bucket update for Redis, atomic per key; cost 0 only checks, -1 refunds. Returns {allowed, retry_after}
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 or cost < 0 then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+def parse_limit(value):
+    """Parse 'attempts/seconds' into (capacity, tokens per second)"""
+    attempts, seconds = (float(part) for part in str(value).split('/'))
+    return attempts, attempts / seconds
+
+
+class TokenBuckets:
+    """In-process token buckets; the least recently used keys are dropped beyond max_keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        """Take `cost` tokens (0 only checks, -1 refunds); returns seconds to wait, or 0 when allowed"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            retry_after = 0
+            if tokens >= 1 or cost < 0:
+                tokens = min(capacity, tokens - cost)
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisTokenBuckets:
+    """Token buckets shared by all workers (requires the optional redis package)"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('THROTTLE_STORAGE=redis requires the "redis" package') from e
+        self.client = redis.Redis.from_url(url)
+        self._take = self.client.register_script(_REDIS_TAKE)
+
+    def take(self, key, capacity, rate, cost=1):
+        allowed, retry_after = self._take(keys=[f'throttle:{key}'], args=[capacity, rate, time.time(), cost])
+        return 0 if int(allowed) else float(retry_after)
+
+
+class LoginThrottle:
+    """Per-IP and per-identifier login limits with counters of throttled attempts"""
+
+    def __init__(self, buckets, ip_limit, identifier_limit, fallback=None):
+        self.buckets = buckets
+        self.fallback = fallback
+        self.ip_limit = parse_limit(ip_limit)
+        self.identifier_limit = parse_limit(identifier_limit)
+        self.counters = {'allowed': 0, 'throttled_ip': 0, 'throttled_identifier': 0, 'failures': 0, 'storage_errors': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _take(self, key, limit, cost=1):
+        try:
+            return self.buckets.take(key, *limit, cost=cost)
+        except Exception as e:
+            # A shared store outage must not lock everyone out; fall back to this worker's buckets
+            if self.fallback is None:
+                raise
+            self._count('storage_errors')
+            current_app.logger.warning('Login throttle storage failed: %s', e)
+            return self.fallback.take(key, *limit, cost=cost)
+
+    @staticmethod
+    def _identifier_key(identifier):
+        return f"id:{(identifier or '').strip().lower()[:128]}"
+
+    def check(self, ip, identifier):
+        """
+        Take a token for the IP and check, without taking one, that the
+        identifier has tokens left; returns seconds to wait, or 0 when allowed
+        """
+        retry_after = self._take(f'ip:{ip}', self.ip_limit)
+        if retry_after:
+            self._count('throttled_ip')
+            return retry_after
+
+        retry_after = self._take(self._identifier_key(identifier), self.identifier_limit, cost=0)
+        if retry_after:
+            self._count('throttled_identifier')
+            return retry_after
+
+        self._count('allowed')
+        return 0
+
+    def record_success(self, ip):
+        """Give back the IP token of a successful login"""
+        self._take(f'ip:{ip}', self.ip_limit, cost=-1)
+
+    def record_failure(self, identifier):
+        """Charge the identifier's bucket for a failed login"""
+        self._count('failures')
+        self._take(self._identifier_key(identifier), self.identifier_limit)
+
+    def stats(self):
+        """This worker's counters, plus the buckets it tracks when they are in memory"""
+        with self._lock:
+            counters = dict(self.counters)
+        counters['storage'] = 'redis' if isinstance(self.buckets, RedisTokenBuckets) else 'memory'
+        counters['tracked_keys'] = len(self.buckets if self.fallback is None else self.fallback)
+        return counters
+
+
+def init_app(app):
+    """Set up the login throttle of an app"""
+    if app.config.get('THROTTLE_STORAGE', 'memory') == 'redis':
+        buckets, fallback = RedisTokenBuckets(app.config['THROTTLE_REDIS_URL']), TokenBuckets()
+    else:
+        buckets, fallback = TokenBuckets(), None
+
+    app.extensions['throttle'] = LoginThrottle(
+        buckets,
+        app.config['LOGIN_THROTTLE_IP_LIMIT'],
+        app.config['LOGIN_THROTTLE_IDENTIFIER_LIMIT'],
+        fallback
+    )
+
+
+def login_throttle():
+    """Return the login throttle of the current app"""
+    return current_app.extensions['throttle']